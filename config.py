@@ -19,6 +19,10 @@ OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o") # Vision-capable
 GROQ_MODEL = os.getenv("GROQ_MODEL", "llama3-70b-8192") # No Vision
 ANTHROPIC_MODEL = os.getenv("ANTHROPIC_MODEL", "claude-sonnet-4-5-20250929") # Vision-capable
 
+# --- Debugging ---
+# When set, failed jobs include the full Python traceback in their job_failed event.
+DEBUG_TRACE = bool(os.getenv("DEBUG_TRACE"))
+
 # --- Global Directories ---
 # Ensures a consistent directory structure for generated artifacts.
 PROJECT_ROOT = Path(__file__).parent
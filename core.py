@@ -7,6 +7,7 @@ import asyncio
 import aiohttp
 import json
 import os
+from contextlib import asynccontextmanager
 from typing import Dict, Optional, Any
 
 import logging
@@ -14,6 +15,34 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# One pooled aiohttp session for DevTools probes and CapSolver calls, so
+# polling loops and back-to-back solves reuse keep-alive connections
+# instead of paying TCP/TLS setup for a fresh session each time
+_HTTP_SESSION: Optional[aiohttp.ClientSession] = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Return the shared session, creating it on first use in the running loop"""
+    global _HTTP_SESSION
+    if _HTTP_SESSION is None or _HTTP_SESSION.closed:
+        _HTTP_SESSION = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, keepalive_timeout=30)
+        )
+    return _HTTP_SESSION
+
+
+@asynccontextmanager
+async def http_session():
+    """Borrow the shared session; unlike `async with ClientSession()` it stays open"""
+    yield get_http_session()
+
+
+async def close_http_session():
+    global _HTTP_SESSION
+    if _HTTP_SESSION is not None:
+        await _HTTP_SESSION.close()
+        _HTTP_SESSION = None
+
 def get_connected_devices():
     """Get list of connected Android devices and check their status."""
     try:
@@ -448,7 +477,7 @@ async def wait_for_devtools(port: int, timeout: int = 30) -> bool:
     start_time = time.time()
     while time.time() - start_time < timeout:
         try:
-            async with aiohttp.ClientSession() as session:
+            async with http_session() as session:
                 async with session.get(f"http://localhost:{port}/json/version", timeout=2) as resp:
                     if resp.status == 200:
                         data = await resp.json()
@@ -472,7 +501,7 @@ async def wait_for_devtools_v2(port: int, timeout: int = 30) -> bool:
     
     while time.time() - start_time < timeout:
         try:
-            async with aiohttp.ClientSession() as session:
+            async with http_session() as session:
                 # Try multiple endpoints
                 endpoints = ["/json/version", "/json/list", "/json", ""]
                 
@@ -722,7 +751,7 @@ async def test_firefox_connection(device_id: str, port: int = 9222):
         f"http://localhost:2828"  # Marionette port
     ]
     
-    async with aiohttp.ClientSession() as session:
+    async with http_session() as session:
         for url in test_urls:
             try:
                 async with session.get(url, timeout=5) as resp:
@@ -1063,7 +1092,7 @@ class CaptchaSolver:
             return "DEMO.TURNSTILE.TOKEN.FOR.TESTING.INJECTION.MECHANISM." + "x" * 100
         
         try:
-            async with aiohttp.ClientSession() as session:
+            async with http_session() as session:
                 # Create Turnstile solving task with correct CapSolver type
                 create_payload = {
                     "clientKey": self.capsolver_key,
@@ -1226,7 +1255,7 @@ class CaptchaSolver:
             return "DEMO.RECAPTCHA.TOKEN.FOR.TESTING." + "x" * 150
         
         try:
-            async with aiohttp.ClientSession() as session:
+            async with http_session() as session:
                 # Create reCAPTCHA task
                 create_data = {
                     "clientKey": self.capsolver_key,
@@ -1405,7 +1434,7 @@ class CaptchaSolver:
             return "DEMO.HCAPTCHA.TOKEN.FOR.TESTING." + "x" * 100
         
         try:
-            async with aiohttp.ClientSession() as session:
+            async with http_session() as session:
                 create_data = {
                     "clientKey": self.capsolver_key,
                     "task": {
@@ -1455,7 +1484,7 @@ class CaptchaSolver:
             import asyncio
             import time
             
-            async with aiohttp.ClientSession() as session:
+            async with http_session() as session:
                 # Create task
                 create_data = {
                     "clientKey": self.capsolver_key,
@@ -1563,107 +1592,107 @@ class CaptchaSolver:
             
             # Method 1: Standard reCAPTCHA injection
             if captcha_type in ['recaptcha_v2', 'recaptcha_v3', None]:
-                recaptcha_success = await page.evaluate(f"""
-                () => {{
-                    try {{
+                recaptcha_success = await page.evaluate("""
+                (token) => {
+                    try {
                         // Find reCAPTCHA response textarea
                         const textareas = document.querySelectorAll('textarea[name="g-recaptcha-response"]');
                         let injected = false;
                         
-                        textareas.forEach(textarea => {{
+                        textareas.forEach(textarea => {
                             textarea.style.display = 'block';
-                            textarea.value = '{token}';
-                            textarea.dispatchEvent(new Event('input', {{ bubbles: true }}));
-                            textarea.dispatchEvent(new Event('change', {{ bubbles: true }}));
+                            textarea.value = token;
+                            textarea.dispatchEvent(new Event('input', { bubbles: true }));
+                            textarea.dispatchEvent(new Event('change', { bubbles: true }));
                             injected = true;
-                        }});
+                        });
                         
                         // Trigger reCAPTCHA callback if exists
-                        if (window.grecaptcha && window.grecaptcha.getResponse) {{
+                        if (window.grecaptcha && window.grecaptcha.getResponse) {
                             const widgets = document.querySelectorAll('.g-recaptcha');
-                            widgets.forEach((widget, index) => {{
-                                try {{
-                                    if (window.grecaptcha.getResponse(index) !== '{token}') {{
+                            widgets.forEach((widget, index) => {
+                                try {
+                                    if (window.grecaptcha.getResponse(index) !== token) {
                                         // Force set response
-                                        if (window.grecaptcha.enterprise) {{
+                                        if (window.grecaptcha.enterprise) {
                                             window.grecaptcha.enterprise.reset(index);
-                                        }}
+                                        }
                                         const callback = widget.getAttribute('data-callback');
-                                        if (callback && window[callback]) {{
-                                            window[callback]('{token}');
-                                        }}
-                                    }}
-                                }} catch (e) {{
+                                        if (callback && window[callback]) {
+                                            window[callback](token);
+                                        }
+                                    }
+                                } catch (e) {
                                     console.log('reCAPTCHA callback error:', e);
-                                }}
-                            }});
-                        }}
+                                }
+                            });
+                        }
                         
                         return injected;
-                    }} catch (e) {{
+                    } catch (e) {
                         console.log('reCAPTCHA injection error:', e);
                         return false;
-                    }}
-                }}
-                """)
+                    }
+                }
+                """, token)
                 if recaptcha_success:
                     success = True
                     print("✅ reCAPTCHA token injected successfully")
             
             # Method 2: Cloudflare Turnstile injection
             if captcha_type in ['turnstile', None] and not success:
-                turnstile_success = await page.evaluate(f"""
-                () => {{
-                    try {{
+                turnstile_success = await page.evaluate("""
+                (token) => {
+                    try {
                         // Find Turnstile response inputs
                         const inputs = document.querySelectorAll('input[name="cf-turnstile-response"]');
                         let injected = false;
                         
-                        inputs.forEach(input => {{
-                            input.value = '{token}';
-                            input.dispatchEvent(new Event('input', {{ bubbles: true }}));
-                            input.dispatchEvent(new Event('change', {{ bubbles: true }}));
+                        inputs.forEach(input => {
+                            input.value = token;
+                            input.dispatchEvent(new Event('input', { bubbles: true }));
+                            input.dispatchEvent(new Event('change', { bubbles: true }));
                             injected = true;
-                        }});
+                        });
                         
                         // Trigger Turnstile callback
                         const turnstileElements = document.querySelectorAll('.cf-turnstile, [data-sitekey]');
-                        turnstileElements.forEach(element => {{
+                        turnstileElements.forEach(element => {
                             const callback = element.getAttribute('data-callback');
-                            if (callback && window[callback]) {{
-                                try {{
-                                    window[callback]('{token}');
-                                }} catch (e) {{
+                            if (callback && window[callback]) {
+                                try {
+                                    window[callback](token);
+                                } catch (e) {
                                     console.log('Turnstile callback error:', e);
-                                }}
-                            }}
-                        }});
+                                }
+                            }
+                        });
                         
                         // Also try global turnstile object
-                        if (window.turnstile && window.turnstile.reset) {{
-                            try {{
+                        if (window.turnstile && window.turnstile.reset) {
+                            try {
                                 window.turnstile.reset();
-                            }} catch (e) {{
+                            } catch (e) {
                                 console.log('Turnstile reset error:', e);
-                            }}
-                        }}
+                            }
+                        }
                         
                         return injected;
-                    }} catch (e) {{
+                    } catch (e) {
                         console.log('Turnstile injection error:', e);
                         return false;
-                    }}
-                }}
-                """)
+                    }
+                }
+                """, token)
                 if turnstile_success:
                     success = True
                     print("✅ Turnstile token injected successfully")
             
             # Method 3: Generic injection for unknown types
             if not success:
-                generic_success = await page.evaluate(f"""
-                () => {{
-                    try {{
+                generic_success = await page.evaluate("""
+                (token) => {
+                    try {
                         let injected = false;
                         
                         // Try all common CAPTCHA response fields
@@ -1676,27 +1705,27 @@ class CaptchaSolver:
                             'textarea[name*="token"]'
                         ];
                         
-                        selectors.forEach(selector => {{
+                        selectors.forEach(selector => {
                             const elements = document.querySelectorAll(selector);
-                            elements.forEach(element => {{
+                            elements.forEach(element => {
                                 if (element.name.toLowerCase().includes('captcha') || 
                                     element.name.toLowerCase().includes('response') ||
-                                    element.name.toLowerCase().includes('token')) {{
-                                    element.value = '{token}';
-                                    element.dispatchEvent(new Event('input', {{ bubbles: true }}));
-                                    element.dispatchEvent(new Event('change', {{ bubbles: true }}));
+                                    element.name.toLowerCase().includes('token')) {
+                                    element.value = token;
+                                    element.dispatchEvent(new Event('input', { bubbles: true }));
+                                    element.dispatchEvent(new Event('change', { bubbles: true }));
                                     injected = true;
-                                }}
-                            }});
-                        }});
+                                }
+                            });
+                        });
                         
                         return injected;
-                    }} catch (e) {{
+                    } catch (e) {
                         console.log('Generic injection error:', e);
                         return false;
-                    }}
-                }}
-                """)
+                    }
+                }
+                """, token)
                 if generic_success:
                     success = True
                     print("✅ Generic CAPTCHA token injected")
@@ -1743,7 +1772,7 @@ class CaptchaSolver:
             import asyncio
             import time
             
-            async with aiohttp.ClientSession() as session:
+            async with http_session() as session:
                 # Create task
                 create_data = {
                     "clientKey": self.capsolver_key,
@@ -1817,45 +1846,45 @@ class CaptchaSolver:
             
             if captcha_type == 'turnstile':
                 # TURNSTILE INJECTION - Multiple methods
-                turnstile_success = await page.evaluate(f"""
-                    (() => {{
+                turnstile_success = await page.evaluate("""
+                    (token) => {
                         let injected = false;
                         
                         // Method 1: Find by name attributes
                         const responseInputs = document.querySelectorAll('input[name*="cf-turnstile-response"], input[name*="turnstile-response"], input[id*="turnstile"]');
-                        for (const input of responseInputs) {{
-                            input.value = '{token}';
-                            input.dispatchEvent(new Event('input', {{ bubbles: true }}));
-                            input.dispatchEvent(new Event('change', {{ bubbles: true }}));
+                        for (const input of responseInputs) {
+                            input.value = token;
+                            input.dispatchEvent(new Event('input', { bubbles: true }));
+                            input.dispatchEvent(new Event('change', { bubbles: true }));
                             injected = true;
-                        }}
+                        }
                         
                         // Method 2: Find within Turnstile containers
                         const turnstileContainers = document.querySelectorAll('.cf-turnstile, [data-sitekey], iframe[src*="turnstile"]');
-                        for (const container of turnstileContainers) {{
+                        for (const container of turnstileContainers) {
                             const hiddenInputs = container.querySelectorAll('input[type="hidden"]');
-                            for (const input of hiddenInputs) {{
-                                if (input.name.includes('response') || input.name.includes('turnstile')) {{
-                                    input.value = '{token}';
-                                    input.dispatchEvent(new Event('change', {{ bubbles: true }}));
+                            for (const input of hiddenInputs) {
+                                if (input.name.includes('response') || input.name.includes('turnstile')) {
+                                    input.value = token;
+                                    input.dispatchEvent(new Event('change', { bubbles: true }));
                                     injected = true;
-                                }}
-                            }}
-                        }}
+                                }
+                            }
+                        }
                         
                         // Method 3: Callback triggering
-                        if (window.turnstile && typeof window.turnstile.callback === 'function') {{
-                            try {{
-                                window.turnstile.callback('{token}');
+                        if (window.turnstile && typeof window.turnstile.callback === 'function') {
+                            try {
+                                window.turnstile.callback(token);
                                 injected = true;
-                            }} catch (e) {{
+                            } catch (e) {
                                 console.log('Turnstile callback error:', e);
-                            }}
-                        }}
+                            }
+                        }
                         
                         return injected;
-                    }})()
-                """)
+                    }
+                """, token)
                 
                 if turnstile_success:
                     success = True
@@ -1863,10 +1892,9 @@ class CaptchaSolver:
             
             elif captcha_type in ['recaptcha_v2', 'recaptcha_v3']:
                 # ENHANCED RECAPTCHA INJECTION - Multiple sophisticated methods for all reCAPTCHA types
-                recaptcha_success = await page.evaluate(f"""
-                    (() => {{
+                recaptcha_success = await page.evaluate("""
+                    (token) => {
                         let injected = false;
-                        const token = '{token}';
                         
                         // Method 1: Standard reCAPTCHA response textareas (all variants)
                         const textareaSelectors = [
@@ -1877,33 +1905,33 @@ class CaptchaSolver:
                             'textarea[name*="captcha"]'
                         ];
                         
-                        for (const selector of textareaSelectors) {{
+                        for (const selector of textareaSelectors) {
                             const textareas = document.querySelectorAll(selector);
-                            for (const textarea of textareas) {{
+                            for (const textarea of textareas) {
                                 textarea.style.display = 'block';
                                 textarea.style.visibility = 'visible';
                                 textarea.value = token;
                                 textarea.innerHTML = token;
                                 
                                 // Trigger all possible events
-                                ['input', 'change', 'keyup', 'blur'].forEach(eventType => {{
-                                    textarea.dispatchEvent(new Event(eventType, {{ bubbles: true, cancelable: true }}));
-                                }});
+                                ['input', 'change', 'keyup', 'blur'].forEach(eventType => {
+                                    textarea.dispatchEvent(new Event(eventType, { bubbles: true, cancelable: true }));
+                                });
                                 
                                 injected = true;
                                 console.log('reCAPTCHA textarea injected:', selector);
-                            }}
-                        }}
+                            }
+                        }
                         
                         // Method 2: Enhanced Callback Triggering
-                        if (window.grecaptcha) {{
+                        if (window.grecaptcha) {
                             // Try to get all widget IDs and set response
-                            try {{
+                            try {
                                 const widgets = document.querySelectorAll('.g-recaptcha, [data-sitekey], iframe[src*="recaptcha"]');
-                                widgets.forEach((widget, index) => {{
-                                    try {{
+                                widgets.forEach((widget, index) => {
+                                    try {
                                         // Try to get widget ID and set response directly
-                                        if (window.grecaptcha.getResponse) {{
+                                        if (window.grecaptcha.getResponse) {
                                             const widgetId = widget.getAttribute('data-widget-id') || index;
                                             
                                             // Override the getResponse function temporarily
@@ -1915,93 +1943,93 @@ class CaptchaSolver:
                                                            widget.getAttribute('callback') ||
                                                            widget.dataset.callback;
                                                            
-                                            if (callback) {{
-                                                if (typeof window[callback] === 'function') {{
+                                            if (callback) {
+                                                if (typeof window[callback] === 'function') {
                                                     window[callback](token);
                                                     injected = true;
                                                     console.log('Callback triggered:', callback);
-                                                }}
+                                                }
                                                 
                                                 // Try as object method
-                                                if (callback.includes('.')) {{
+                                                if (callback.includes('.')) {
                                                     const parts = callback.split('.');
                                                     let obj = window;
-                                                    for (let i = 0; i < parts.length - 1; i++) {{
+                                                    for (let i = 0; i < parts.length - 1; i++) {
                                                         if (obj[parts[i]]) obj = obj[parts[i]];
-                                                    }}
-                                                    if (obj && typeof obj[parts[parts.length - 1]] === 'function') {{
+                                                    }
+                                                    if (obj && typeof obj[parts[parts.length - 1]] === 'function') {
                                                         obj[parts[parts.length - 1]](token);
                                                         injected = true;
                                                         console.log('Object callback triggered:', callback);
-                                                    }}
-                                                }}
-                                            }}
+                                                    }
+                                                }
+                                            }
                                             
                                             // Restore original function
-                                            setTimeout(() => {{
+                                            setTimeout(() => {
                                                 window.grecaptcha.getResponse = originalGetResponse;
-                                            }}, 1000);
-                                        }}
-                                    }} catch (e) {{
+                                            }, 1000);
+                                        }
+                                    } catch (e) {
                                         console.log('Widget callback error:', e);
-                                    }}
-                                }});
-                            }} catch (e) {{
+                                    }
+                                });
+                            } catch (e) {
                                 console.log('grecaptcha error:', e);
-                            }}
-                        }}
+                            }
+                        }
                         
                         // Method 3: Find and trigger form submission callbacks
                         const forms = document.querySelectorAll('form');
-                        forms.forEach(form => {{
-                            try {{
+                        forms.forEach(form => {
+                            try {
                                 const captchaElements = form.querySelectorAll('[data-sitekey], .g-recaptcha, iframe[src*="recaptcha"]');
-                                if (captchaElements.length > 0) {{
+                                if (captchaElements.length > 0) {
                                     // Look for submit buttons and check if they become enabled
                                     const submitButtons = form.querySelectorAll('button[type="submit"], input[type="submit"], button:not([type])');
-                                    submitButtons.forEach(btn => {{
-                                        if (btn.disabled) {{
+                                    submitButtons.forEach(btn => {
+                                        if (btn.disabled) {
                                             btn.disabled = false;
                                             btn.style.opacity = '1';
                                             btn.style.pointerEvents = 'auto';
                                             console.log('Submit button enabled');
                                             injected = true;
-                                        }}
-                                    }});
-                                }}
-                            }} catch (e) {{
+                                        }
+                                    });
+                                }
+                            } catch (e) {
                                 console.log('Form callback error:', e);
-                            }}
-                        }});
+                            }
+                        });
                         
                         // Method 4: Direct DOM manipulation for checkmark
-                        try {{
+                        try {
                             const recaptchaFrames = document.querySelectorAll('iframe[src*="recaptcha/api2/anchor"]');
-                            recaptchaFrames.forEach(frame => {{
-                                try {{
+                            recaptchaFrames.forEach(frame => {
+                                try {
                                     // Try to access frame content (may be blocked by CORS)
-                                    if (frame.contentDocument) {{
+                                    if (frame.contentDocument) {
                                         const checkbox = frame.contentDocument.querySelector('.recaptcha-checkbox-checkmark');
-                                        if (checkbox) {{
+                                        if (checkbox) {
                                             checkbox.style.display = 'block';
                                             checkbox.classList.add('recaptcha-checkbox-checked');
                                             injected = true;
                                             console.log('Checkbox visual updated');
-                                        }}
-                                    }}
-                                }} catch (e) {{
+                                        }
+                                    }
+                                } catch (e) {
                                     // Expected CORS error, but we tried
                                     console.log('Frame access blocked (normal):', e.message);
-                                }}
-                            }});
-                        }} catch (e) {{
+                                }
+                            });
+                        } catch (e) {
                             console.log('Frame manipulation error:', e);
-                        }}
+                        }
                         
                         console.log('reCAPTCHA injection methods completed, injected:', injected);
                         return injected;
-                    }})()
-                """)
+                    }
+                """, token)
                 
                 if recaptcha_success:
                     success = True
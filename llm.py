@@ -229,8 +229,12 @@ def build_enhanced_history(state) -> str:
     
     return "\n".join(history_lines)
 
-def get_agent_action(query: str, url: str, html: str, provider: LLMProvider, screenshot_path: Union[Path, None], history: str) -> Tuple[dict, Dict]:
-    """Gets the next thought and action from the agent, and returns token usage."""
+def get_agent_action(query: str, url: str, provider: LLMProvider, screenshot_path: Union[Path, None], history: str, screenshot_b64: Union[str, None] = None) -> Tuple[dict, Dict]:
+    """Gets the next thought and action from the agent, and returns token usage.
+
+    screenshot_b64, when given, is the already-encoded JPEG of screenshot_path
+    and is sent as-is instead of reading the file back from disk.
+    """
     screenshot_note = ""
     if not screenshot_path:
         screenshot_note = "\n\n**⚠️ NOTE: Screenshot capture failed - relying on HTML content only.**"
@@ -239,7 +243,10 @@ def get_agent_action(query: str, url: str, html: str, provider: LLMProvider, scr
     system_prompt = "You are an autonomous web agent. Respond ONLY with a JSON object containing 'thought' and 'action'. No other text."
 
     try:
-        images = [screenshot_path] if screenshot_path else []
+        if screenshot_path and screenshot_b64:
+            images = [("image/jpeg", screenshot_b64)]
+        else:
+            images = [screenshot_path] if screenshot_path else []
         response_text, usage = get_llm_response(system_prompt, prompt, provider, images=images)
         
         if not response_text or not response_text.strip():
@@ -265,11 +272,29 @@ def get_agent_action(query: str, url: str, html: str, provider: LLMProvider, scr
         return error_action, error_usage
 
 
+def image_media_type(path: Path) -> str:
+    """Media type for a screenshot file, based on its extension."""
+    return "image/jpeg" if path.suffix.lower() in (".jpg", ".jpeg") else "image/png"
+
+def load_image(image: Union[Path, Tuple[str, str]]) -> Union[Tuple[str, str], None]:
+    """(media_type, base64 data) for a screenshot path or an already-encoded image."""
+    if isinstance(image, tuple):
+        return image if image[1] else None
+    if image and image.exists() and image.stat().st_size > 0:
+        try:
+            with open(image, "rb") as f:
+                img_data = base64.b64encode(f.read()).decode("utf-8")
+            if img_data:
+                return image_media_type(image), img_data
+        except Exception as e:
+            print(f"Warning: Failed to read screenshot {image}: {e}")
+    return None
+
 def get_llm_response(
     system_prompt: str,
     prompt: str,
     provider: LLMProvider,
-    images: List[Path]
+    images: List[Union[Path, Tuple[str, str]]]
 ) -> Tuple[str, Dict]:
     """Gets a response and token usage from the specified LLM provider."""
     usage = {"input_tokens": 0, "output_tokens": 0}
@@ -280,15 +305,10 @@ def get_llm_response(
         messages = [{"role": "user", "content": [{"type": "text", "text": prompt}]}]
 
         if images:
-            last_image_path = images[-1]
-            if last_image_path and last_image_path.exists() and last_image_path.stat().st_size > 0:
-                try:
-                    with open(last_image_path, "rb") as f: 
-                        img_data = base64.b64encode(f.read()).decode("utf-8")
-                        if img_data:
-                            messages[0]["content"].append({"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": img_data}})
-                except Exception as e:
-                    print(f"Warning: Failed to read screenshot {last_image_path}: {e}")
+            loaded = load_image(images[-1])
+            if loaded:
+                media_type, img_data = loaded
+                messages[0]["content"].append({"type": "image", "source": {"type": "base64", "media_type": media_type, "data": img_data}})
 
         response = anthropic_client.messages.create(model=ANTHROPIC_MODEL, max_tokens=2048, system=system_prompt, messages=messages)
         usage = {"input_tokens": response.usage.input_tokens, "output_tokens": response.usage.output_tokens}
@@ -306,15 +326,11 @@ def get_llm_response(
         if not openai_client: raise ValueError("OpenAI client not initialized.")
         
         messages = [{"role": "user", "content": [{"type": "text", "text": prompt}]}]
-        for img_path in images:
-            if img_path and img_path.exists() and img_path.stat().st_size > 0:
-                try:
-                    with open(img_path, "rb") as f: 
-                        img_data = base64.b64encode(f.read()).decode("utf-8")
-                        if img_data:
-                            messages[0]["content"].append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{img_data}"}})
-                except Exception as e:
-                    print(f"Warning: Failed to read screenshot {img_path}: {e}")
+        for image in images:
+            loaded = load_image(image)
+            if loaded:
+                media_type, img_data = loaded
+                messages[0]["content"].append({"type": "image_url", "image_url": {"url": f"data:{media_type};base64,{img_data}"}})
         
         response = openai_client.chat.completions.create(model=OPENAI_MODEL, max_tokens=2048, messages=[{"role": "system", "content": system_prompt}, *messages])
         if response.usage:
@@ -1,54 +1,183 @@
 import asyncio
+import base64
+import os
+import contextvars
+import heapq
 import platform
 import re
+import stat
 import uuid
-import json
+import orjson
 import time
 import csv
 from pathlib import Path
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlsplit
 import traceback
-from typing import List, TypedDict, Dict, Any, Optional
+import weakref
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from functools import lru_cache, partial
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional
 import logging
-import aiohttp
 import subprocess
 from core import (
     force_stop_browser, start_firefox_private, enable_firefox_debugging, 
     get_devtools_port, wait_for_devtools, forward_port, 
     setup_firefox_automation_v2, force_stop_chrome, start_chrome_incognito, 
-    start_chrome_normal, setup_chrome_automation_android, CaptchaSolver
+    start_chrome_normal, setup_chrome_automation_android, CaptchaSolver,
+    http_session, close_http_session
 )
 # from captcha_handler import (
 #     auto_solve_captcha_if_present, smart_captcha_handler, 
 #     handle_captcha_on_page, handle_captcha_immediately
 # )
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse, FileResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response, StreamingResponse, FileResponse, JSONResponse, ORJSONResponse
 from pydantic import BaseModel
 from patchright.async_api import async_playwright, Page, Browser  # 🔥 NEW: Cloudflare bypass
+from patchright.async_api import TimeoutError as PlaywrightTimeoutError
 from PIL import Image
 from langgraph.graph import StateGraph, END
-from bs4 import BeautifulSoup
 
 from llm import LLMProvider, get_refined_prompt, get_agent_action
-from config import SCREENSHOTS_DIR, ANTHROPIC_MODEL, GROQ_MODEL, OPENAI_MODEL
+from config import SCREENSHOTS_DIR, ANTHROPIC_MODEL, GROQ_MODEL, OPENAI_MODEL, DEBUG_TRACE
 
 # ==================== SETUP ====================
-app = FastAPI(title="LangGraph Web Agent with Memory")
+class ScreenshotAwareGZipMiddleware(GZipMiddleware):
+    """GZip responses except screenshots, whose JPEG/PNG bytes are already compressed"""
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith("/screenshots/"):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Output directories are created once here rather than on every report
+    ANALYSIS_DIR.mkdir(exist_ok=True)
+    SCREENSHOTS_DIR.mkdir(exist_ok=True)
+    report_flusher = asyncio.create_task(_report_flush_loop())
+    stuck_job_sweeper = asyncio.create_task(_stuck_job_sweep_loop())
+    yield
+    # Tell connected clients first: a cancelled job's own finally only
+    # reports job_done, which would read as a normal finish
+    for job_id in list(JOB_QUEUES):
+        push_status(job_id, "job_failed", {"error": "Server shutting down"})
+    for task in list(BACKGROUND_TASKS):
+        task.cancel()
+    # run_job's finally blocks close their pages and CDP connections
+    await asyncio.gather(*BACKGROUND_TASKS, return_exceptions=True)
+    report_flusher.cancel()
+    stuck_job_sweeper.cancel()
+    flush_report_rows()
+    await stop_playwright()
+    await close_http_session()
+
+# Endpoints return plain dicts: encode them with orjson rather than json.dumps
+app = FastAPI(
+    title="LangGraph Web Agent with Memory",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
+)
+# Result and status JSON compress well; SSE responses are left uncompressed
+# by the middleware itself
+app.add_middleware(ScreenshotAwareGZipMiddleware, minimum_size=1024, compresslevel=5)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # ==================== STORAGE ====================
 JOB_QUEUES = {}
 JOB_RESULTS = {}
-USER_INPUT_REQUESTS = {}
-USER_INPUT_RESPONSES = {}
-PENDING_JOBS = {}
+@dataclass(slots=True)
+class InputWait:
+    """A job parked on request_user_input: what it asked and the future the answer resolves"""
+    request: dict
+    pending: asyncio.Future
+    deadline: float  # epoch seconds after which cleanup_stuck_jobs reclaims it
+
+INPUT_WAITS: Dict[str, InputWait] = {}  # job_id -> open input request; one lookup per endpoint
 JOBS_IN_INPUT_FLOW = set()  # 🔒 Global protection for user input
+BACKGROUND_TASKS = set()  # strong refs to running run_job tasks
+
+class StatusStream:
+    """Bounded per-job status buffer: drop-oldest on overflow, Event for wakeups"""
+    def __init__(self, maxlen: int = 1024, keepalive: float = 60, coalesce: float = 0.01):
+        self.buf = deque(maxlen=maxlen)
+        self.evt = asyncio.Event()
+        self.keepalive = keepalive
+        self.coalesce = coalesce
+    
+    def push(self, entry: dict):
+        self.buf.append(entry)
+        self.evt.set()
+    
+    def reset(self):
+        self.buf.clear()
+        self.evt.clear()
+    
+    async def __aiter__(self):
+        """Yield lists of buffered entries, or None every `keepalive` idle seconds"""
+        # One repeating timer per reader instead of a wait_for timeout (and its
+        # timer handle and cancel) around every wait for data
+        loop = asyncio.get_running_loop()
+        pinged = False
+        timer = None
+        
+        def ping():
+            nonlocal pinged, timer
+            pinged = True
+            self.evt.set()
+            timer = loop.call_later(self.keepalive, ping)
+        
+        timer = loop.call_later(self.keepalive, ping)
+        try:
+            while True:
+                if not self.buf:
+                    self.evt.clear()
+                    await self.evt.wait()
+                    if not self.buf:
+                        if pinged:
+                            pinged = False
+                            yield None
+                        continue
+                    # Let the burst of pushes from one step land in a single batch
+                    await asyncio.sleep(self.coalesce)
+                pinged = False
+                batch = list(self.buf)
+                self.buf.clear()
+                yield batch
+        finally:
+            timer.cancel()
+
+# ♻️ Free-list of drained status streams, reused across jobs
+QUEUE_POOL_SIZE = 128
+_QUEUE_POOL: List[StatusStream] = []
+_QUEUE_READERS: Dict[str, int] = {}  # job_id -> active SSE readers
+
+STUCK_INPUT_TIMEOUT = 600  # seconds before a pending input request is reclaimed
+_INPUT_DEADLINES: List[tuple] = []  # min-heap of (deadline_ts, job_id)
+STUCK_SWEEP_INTERVAL = 30  # seconds between background stuck-input sweeps
+_STUCK_JOBS_CLEANED = 0  # total reclaimed since startup, for /admin/system-status
+
+JOB_RESULT_TTL = 3600  # seconds a finished job's result stays fetchable
+JOB_RESULTS_MAX = 1024  # oldest results are dropped beyond this many
+SCREENSHOT_INDEX: Dict[str, Dict[str, os.stat_result]] = {}  # job_id -> filename -> stat, for finished jobs
+_RESULT_DEADLINES: List[tuple] = []  # min-heap of (expires_at, job_id)
+
+STATUS_CACHE_SIZE = 256
+STATUS_MAX_WAIT = 60  # cap on /jobs/{job_id}/status?wait= long-polls
+_STATUS_EVENTS: Dict[str, asyncio.Event] = {}  # job_id -> event set on its next state change
+_STATUS_CACHE: "OrderedDict[str, tuple]" = OrderedDict()  # job_id -> (snapshot, body)
 
 # ==================== COST TRACKING ====================
 ANALYSIS_DIR = Path("analysis")
 REPORT_CSV_FILE = Path("report.csv")
+REPORT_CSV_HEADER = ['job_id', 'total_input_tokens', 'total_output_tokens', 'total_cost_usd']
+REPORT_FLUSH_INTERVAL = 2.0  # seconds between batched report.csv appends
+_REPORT_ROWS: List[list] = []  # rows waiting for the next flush
+_report_header_checked = False
 
 TOKEN_COSTS = {
     "anthropic": {
@@ -65,6 +194,34 @@ TOKEN_COSTS = {
     }
 }
 
+NANODOLLARS_PER_CSV_UNIT = 10_000  # report costs are formatted to 5 decimals
+
+# Flat (provider, model) -> (input, output) integer nanodollars per token.
+# USD per 1M tokens * 1000 == nanodollars per token, e.g. 3.0 -> 3000
+_COST_TABLE = {
+    (provider, model): (round(rates["input"] * 1000), round(rates["output"] * 1000))
+    for provider, models in TOKEN_COSTS.items()
+    for model, rates in models.items()
+}
+
+# Unlisted model names fall back to a priced model of the same family
+_MODEL_FAMILY_RE = re.compile(r"sonnet|haiku", re.IGNORECASE)
+_MODEL_FAMILY_FALLBACK = {
+    ("anthropic", "sonnet"): "claude-3-5-sonnet-20240620",
+    ("anthropic", "haiku"): "claude-3-haiku-20240307",
+}
+
+@lru_cache(maxsize=64)
+def _resolve_cost_rates(provider: str, model: str) -> Optional[tuple]:
+    """Look up (input, output) rates for a model, resolving family aliases"""
+    rates = _COST_TABLE.get((provider, model))
+    if rates is None:
+        family = _MODEL_FAMILY_RE.search(model)
+        if family:
+            fallback = _MODEL_FAMILY_FALLBACK.get((provider, family.group(0).lower()))
+            rates = _COST_TABLE.get((provider, fallback))
+    return rates
+
 MODEL_MAPPING = {
     LLMProvider.ANTHROPIC: ANTHROPIC_MODEL,
     LLMProvider.GROQ: GROQ_MODEL,
@@ -97,140 +254,510 @@ POPUP_SELECTORS = [
     "[aria-label*='dismiss']", "button.close", ".modal-close"
 ]
 
+def _compile_phrases(phrases: List[str]) -> re.Pattern:
+    """Compile literal phrases into one case-insensitive alternation (longest first)"""
+    ordered = sorted(set(phrases), key=len, reverse=True)
+    return re.compile("|".join(map(re.escape, ordered)), re.IGNORECASE)
+
+# Selectors too generic to target a single element without a prior search
+GENERIC_SELECTORS = frozenset(['button', 'input', 'a', '.btn', 'div', 'span'])
+
+# ==================== LOGIN FAILURE CONFIG ====================
+LOGIN_FAILURE_INDICATORS = [
+    "invalid credentials", "login failed", "incorrect password", 
+    "incorrect username", "authentication failed", "login error",
+    "wrong password", "invalid login", "access denied", "login unsuccessful",
+    "incorrect email", "invalid email", "user not found", "account not found",
+    "too many attempts", "account locked", "temporarily locked"
+]
+
+AUTH_URL_INDICATORS = ["/login", "/signin", "/auth", "/error", "/failure"]
+
+_LOGIN_FAILURE_RE = _compile_phrases(LOGIN_FAILURE_INDICATORS)
+_AUTH_URL_RE = _compile_phrases(AUTH_URL_INDICATORS)
+
+# Selectors that target a password field ("pass" also covers "password")
+_PASSWORD_SELECTOR_RE = re.compile(r"pass", re.IGNORECASE)
+_JOB_ID_RE = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+_SCREENSHOT_NAME_RE = re.compile(r"\w[\w.-]*\.(?:jpg|png)")
+USER_INPUT_PLACEHOLDERS = frozenset(["{{USER_INPUT}}", "{{PASSWORD}}", "{{EMAIL}}", "{{PHONE}}", "{{OTP}}"])
+
 # ==================== HELPER FUNCTIONS ====================
 def get_current_timestamp():
     return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
 
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match check per RFC 9110: '*', a list of tags, weak comparison"""
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+def notify_status_change(job_id: str):
+    """Wake /jobs/{job_id}/status long-polls parked on this job"""
+    evt = _STATUS_EVENTS.pop(job_id, None)
+    if evt:
+        evt.set()
+
 def push_status(job_id: str, msg: str, details: dict = None):
     q = JOB_QUEUES.get(job_id)
     if q:
         entry = {"ts": get_current_timestamp(), "msg": msg}
         if details: entry["details"] = details
-        q.put_nowait(entry)
+        q.push(entry)
+
+def _acquire_queue() -> StatusStream:
+    """Take a status stream from the pool, or create one if the pool is empty"""
+    return _QUEUE_POOL.pop() if _QUEUE_POOL else StatusStream()
+
+def _release_queue(q: StatusStream):
+    """Drop leftover entries and return the stream to the pool"""
+    q.reset()
+    if len(_QUEUE_POOL) < QUEUE_POOL_SIZE:
+        _QUEUE_POOL.append(q)
+
+def _drop_job_result(job_id: str):
+    """Forget a finished job's result and everything derived from it"""
+    JOB_RESULTS.pop(job_id, None)
+    SCREENSHOT_INDEX.pop(job_id, None)
+    # The cached status body embeds the full result
+    _STATUS_CACHE.pop(job_id, None)
+    notify_status_change(job_id)
+
+def store_job_result(job_id: str, result: dict):
+    """Record a finished job's result, dropping expired and excess old ones"""
+    now = time.time()
+    while _RESULT_DEADLINES and _RESULT_DEADLINES[0][0] < now:
+        _, expired_id = heapq.heappop(_RESULT_DEADLINES)
+        _drop_job_result(expired_id)
+    JOB_RESULTS[job_id] = result
+    notify_status_change(job_id)
+    while len(JOB_RESULTS) > JOB_RESULTS_MAX:
+        _drop_job_result(next(iter(JOB_RESULTS)))
+    heapq.heappush(_RESULT_DEADLINES, (now + JOB_RESULT_TTL, job_id))
+
+def release_pending_job(job_id: str, value: str = ""):
+    """Finish a job's input wait with `value` and wake only that job's waiter"""
+    wait = INPUT_WAITS.get(job_id)
+    if wait and not wait.pending.done():
+        wait.pending.set_result(value)
 
 def cleanup_stuck_jobs():
     """Clean up jobs stuck waiting for user input"""
     current_time = time.time()
     stuck_jobs = []
-    
-    for job_id, request in list(USER_INPUT_REQUESTS.items()):
-        request_time = request.get('timestamp', '')
-        if request_time:
-            try:
-                request_timestamp = time.mktime(time.strptime(request_time, "%Y-%m-%dT%H:%M:%SZ"))
-                if current_time - request_timestamp > 600:
-                    stuck_jobs.append(job_id)
-            except:
-                stuck_jobs.append(job_id)
+    while _INPUT_DEADLINES and _INPUT_DEADLINES[0][0] < current_time:
+        _, job_id = heapq.heappop(_INPUT_DEADLINES)
+        # Entries go stale when a request is answered or replaced; only act
+        # if the job's current request is itself past its deadline
+        wait = INPUT_WAITS.get(job_id)
+        if wait and wait.deadline < current_time:
+            stuck_jobs.append(job_id)
     
     for job_id in stuck_jobs:
         logger.info(f"Cleaning up stuck job: {job_id}")
-        USER_INPUT_REQUESTS.pop(job_id, None)
-        USER_INPUT_RESPONSES.pop(job_id, None)
+        release_pending_job(job_id)
+        INPUT_WAITS.pop(job_id, None)
+        notify_status_change(job_id)
         JOBS_IN_INPUT_FLOW.discard(job_id)
-        if job_id in PENDING_JOBS:
-            PENDING_JOBS[job_id].set()
-            PENDING_JOBS.pop(job_id, None)
     
+    global _STUCK_JOBS_CLEANED
+    _STUCK_JOBS_CLEANED += len(stuck_jobs)
     return len(stuck_jobs)
 
+async def _stuck_job_sweep_loop():
+    """Background sweeper for input requests nobody answered"""
+    while True:
+        await asyncio.sleep(STUCK_SWEEP_INTERVAL)
+        cleanup_stuck_jobs()
+
 def detect_login_failure(page_content: str, page_url: str) -> bool:
     """Detect login failure based on page content/URL"""
-    failure_indicators = [
-        "invalid credentials", "login failed", "incorrect password", 
-        "incorrect username", "authentication failed", "login error",
-        "wrong password", "invalid login", "access denied", "login unsuccessful",
-        "incorrect email", "invalid email", "user not found", "account not found",
-        "too many attempts", "account locked", "temporarily locked"
-    ]
-    
-    url_indicators = ["/login", "/signin", "/auth", "/error", "/failure"]
-    
-    content_lower = page_content.lower()
-    url_lower = page_url.lower()
-    
-    content_has_failure = any(indicator in content_lower for indicator in failure_indicators)
-    still_on_auth_page = any(indicator in url_lower for indicator in url_indicators)
-    
-    return content_has_failure or still_on_auth_page
+    # Single pass over the page per check; IGNORECASE avoids a lowered copy
+    return bool(_LOGIN_FAILURE_RE.search(page_content) or _AUTH_URL_RE.search(page_url))
+
+@lru_cache(maxsize=2048)
+def _action_signature(action_type, selector, text, key) -> str:
+    parts = [action_type]
+    for name, val in (("selector", selector), ("text", text), ("key", key)):
+        if val:
+            truncated = val.strip()
+            if truncated:
+                if len(truncated) > 80:
+                    truncated = truncated[:77] + "..."
+                parts.append(f"{name}={truncated}")
+    return "|".join(parts) or "invalid"
 
 def make_action_signature(action: dict) -> str:
     """Create normalized signature for action deduplication"""
     if not isinstance(action, dict) or not action:
         return "invalid"
-    parts = [action.get("type", "")]
-    for key in ("selector", "text", "key"):
-        val = action.get(key)
-        if isinstance(val, str) and val.strip():
-            truncated = val.strip()
-            if len(truncated) > 80:
-                truncated = truncated[:77] + "..."
-            parts.append(f"{key}={truncated}")
-    return "|".join(parts) or "invalid"
+    # Only string fields take part in the signature; repeats hit the cache
+    fields = [action.get(name) for name in ("selector", "text", "key")]
+    return _action_signature(
+        action.get("type", ""),
+        *(val if isinstance(val, str) else None for val in fields)
+    )
+
+def _resolve_item_url(base_url: str, origin: Optional[str], url: str) -> str:
+    """urljoin with string fast paths for absolute URLs and root-relative paths"""
+    # urljoin would rewrite dot segments and trailing empty query/fragment
+    if '/.' not in url and url[-1:] not in ('?', '#') and '?#' not in url:
+        if url.startswith(('http://', 'https://')):
+            return url
+        if origin and url.startswith('/') and not url.startswith('//'):
+            return origin + url
+    return urljoin(base_url, url)
 
 # ==================== ELEMENT SEARCH ====================
-def find_elements_with_attribute_text_detailed(html: str, text: str) -> List[Dict[str, Any]]:
-    """Static HTML search fallback"""
-    if not html or not text:
-        return []
+# Installed lazily into the page's isolated world by the first search in each
+# document; later searches only ship the query text as an argument.
+FIND_ELEMENTS_JS = """
+(function() {
+    if (window.__findElements) return;
+    const MAX_LAYOUT_CANDIDATES = 20;
+    const BEST_CHEAP_SCORE = 15;  // interactive hint (5) + exact match (100 / 10)
+    
+    // Constant tables and helpers live in the init-script closure so a
+    // search call allocates nothing but its own results
+    const SELECTOR_ATTRS = ['name', 'type', 'role', 'aria-label'];
+    const MATCH_PROPS = ['placeholder', 'value', 'title', 'alt', 'aria-label'];
+    const INTERACTIVE_TAGS = {'button': 1, 'a': 1, 'input': 1, 'select': 1, 'textarea': 1};
+    
+    function normalizeText(text) {
+        if (!text) return '';
+        return text.toLowerCase()
+            .replace(/[\\s_-]+/g, '')
+            .replace(/[^a-z0-9]/g, '');
+    }
+    
+    function calculateMatchScore(search, targetNorm, originalTarget) {
+        const searchNorm = search.norm;
+        let score = 0;
+        
+        if (targetNorm === searchNorm) {
+            score = 100;
+        } else if (targetNorm.startsWith(searchNorm)) {
+            score = 80;
+        } else if (targetNorm.includes(searchNorm)) {
+            score = 60;
+        } else if (targetNorm.endsWith(searchNorm)) {
+            score = 40;
+        } else {
+            return 0;
+        }
         
-    soup = BeautifulSoup(html, 'html.parser')
-    matching_elements = []
-    text_lower = text.lower()
-
-    for element in soup.find_all(True):
-        if not hasattr(element, 'attrs') or not element.attrs:
-            continue
+        if (targetNorm.length === searchNorm.length) score += 20;
+        if (search.hasSpace && originalTarget.includes(' ')) score += 10;
+        
+        return Math.min(score, 100);
+    }
+    
+    function generateSelector(element) {
+        const selectors = [];
+        
+        if (element.id) {
+            selectors.push('#' + element.id);
+        }
+        
+        if (element.className && typeof element.className === 'string') {
+            const classes = element.className.trim().split(/\\s+/).filter(c => c.length > 0);
+            if (classes.length > 0) {
+                selectors.push('.' + classes.join('.'));
+            }
+        }
+        
+        for (let attr of element.attributes) {
+            if (attr.name.startsWith('data-') && attr.value) {
+                selectors.push(`[${attr.name}="${attr.value}"]`);
+            }
+        }
+        
+        for (const attrName of SELECTOR_ATTRS) {
+            const value = element.getAttribute(attrName);
+            if (value) {
+                selectors.push(`[${attrName}="${value}"]`);
+            }
+        }
+        
+        const textContent = element.textContent?.trim();
+        if (textContent && textContent.length > 0 && textContent.length < 50) {
+            selectors.push(`text="${textContent}"`);
+            selectors.push(`:has-text("${textContent}")`);
+        }
+        
+        selectors.push(element.tagName.toLowerCase());
+        
+        return selectors;
+    }
+    
+    // Normalized textContent per element, reused across the agent's
+    // repeated searches on a page. The observer below drops the text of
+    // every ancestor of a child/text mutation. Attributes are cheap to read
+    // and are not cached, so attribute churn (style/class animation) never
+    // reaches the observer. innerText is never cached: it also depends on
+    // styles that change without touching the element itself
+    const normCache = new WeakMap();
+    let cacheObserver = null;
+    
+    function invalidate(mutations) {
+        for (const mutation of mutations) {
+            for (let node = mutation.target; node; node = node.parentNode) {
+                const entry = normCache.get(node);
+                if (entry) entry.text = null;
+            }
+        }
+    }
+    
+    function syncCache() {
+        if (cacheObserver) {
+            // Records of mutations since the last callback are applied now
+            invalidate(cacheObserver.takeRecords());
+        } else if (document.documentElement) {
+            cacheObserver = new MutationObserver(invalidate);
+            cacheObserver.observe(document.documentElement, {
+                childList: true, characterData: true, subtree: true
+            });
+        }
+    }
+    
+    function cacheEntry(element) {
+        let entry = normCache.get(element);
+        if (entry === undefined) {
+            entry = { text: null, textNorm: '' };
+            normCache.set(element, entry);
+        }
+        return entry;
+    }
+    
+    // The one match-score key used by both the pass-1 cut and the final
+    // ranking: text matches carry `score`, attribute matches `maxScore`
+    function bestMatchScore(matches) {
+        let best = 0;
+        for (let m = 0; m < matches.length; m++) {
+            const score = matches[m].score || matches[m].maxScore || 0;
+            if (score > best) best = score;
+        }
+        return best;
+    }
+    
+    function checkElement(element, search) {
+        const matches = [];
+        const entry = cacheEntry(element);
+        
+        for (const attr of element.attributes) {
+            const attrName = attr.name;
+            const attrValue = attr.value;
+            const nameScore = calculateMatchScore(search, normalizeText(attrName), attrName);
+            const valueScore = calculateMatchScore(search, normalizeText(attrValue), attrValue);
+            
+            if (nameScore > 0 || valueScore > 0) {
+                matches.push({
+                    type: 'attribute',
+                    name: attrName,
+                    value: attrValue,
+                    nameMatch: nameScore > 0,
+                    valueMatch: valueScore > 0,
+                    nameScore: nameScore,
+                    valueScore: valueScore,
+                    maxScore: Math.max(nameScore, valueScore)
+                });
+            }
+        }
+        
+        // Reading textContent/innerText costs O(subtree) per element (and
+        // innerText a layout); skipped when the document text cannot match
+        if (search.textMayMatch && entry.text === null) {
+            entry.text = element.textContent?.trim() || '';
+            entry.textNorm = normalizeText(entry.text);
+        }
+        const textContent = search.textMayMatch ? entry.text : '';
+        const innerText = search.textMayMatch ? element.innerText?.trim() || '' : '';
+        
+        const textContentNorm = search.textMayMatch ? entry.textNorm : '';
+        const textContentScore = calculateMatchScore(search, textContentNorm, textContent);
+        
+        if (textContentScore > 0) {
+            matches.push({
+                type: 'textContent',
+                value: textContent,
+                match: true,
+                score: textContentScore
+            });
+        }
+        
+        if (innerText !== textContent) {
+            const innerTextNorm = normalizeText(innerText);
+            const innerTextScore = calculateMatchScore(search, innerTextNorm, innerText);
             
-        matched_attributes = []
+            if (innerTextScore > 0) {
+                matches.push({
+                    type: 'innerText', 
+                    value: innerText,
+                    match: true,
+                    score: innerTextScore
+                });
+            }
+        }
         
-        for attr_name, attr_value in element.attrs.items():
-            try:
-                if attr_value is None:
-                    continue
-                    
-                if isinstance(attr_value, list):
-                    attr_value_str = ' '.join(str(v) for v in attr_value)
-                else:
-                    attr_value_str = str(attr_value)
-                
-                name_match = text_lower in attr_name.lower()
-                value_match = text_lower in attr_value_str.lower()
+        for (const prop of MATCH_PROPS) {
+            const value = element[prop] || element.getAttribute(prop);
+            if (value) {
+                const valueNorm = normalizeText(value);
+                const propScore = calculateMatchScore(search, valueNorm, value);
                 
-                if name_match or value_match:
-                    matched_attributes.append({
-                        'name': attr_name,
-                        'value': attr_value_str,
-                        'name_match': name_match,
-                        'value_match': value_match
-                    })
-                    
-            except (AttributeError, TypeError):
-                continue
-        
-        if matched_attributes:
-            selectors = []
-            if element.get('id'):
-                selectors.append(f"#{element['id']}")
-            if element.get('class'):
-                classes = element['class'] if isinstance(element['class'], list) else [element['class']]
-                class_strings = [str(cls) for cls in classes]
-                selectors.append(f".{'.'.join(class_strings)}")
-            selectors.append(element.name)
-            
-            for attr in matched_attributes:
-                if attr['name'] not in ['id', 'class']:
-                    selectors.append(f"{element.name}[{attr['name']}*='{attr['value'][:20]}']")
-            
-            matching_elements.append({
-                'element_html': str(element),
-                'tag_name': element.name,
-                'matched_attributes': matched_attributes,
-                'suggested_selectors': selectors[:3],
-                'all_attributes': dict(element.attrs) if element.attrs else {}
-            })
-
-    return matching_elements
+                if (propScore > 0) {
+                    matches.push({
+                        type: 'property',
+                        name: prop,
+                        value: value,
+                        match: true,
+                        score: propScore
+                    });
+                }
+            }
+        }
+        
+        return matches;
+    }
+    
+    window.__findElements = function(rawText) {
+        const searchText = String(rawText || '').toLowerCase();
+        // Normalized once per call instead of once per element
+        const search = { norm: normalizeText(searchText), hasSpace: searchText.includes(' '), textMayMatch: true };
+        // normalizeText only drops or lowercases single characters, so an
+        // element's normalized text is a substring of its document's. If the
+        // whole text (or, for rendered-only text, body.innerText) lacks the
+        // search, no element's text can match and pass 1 checks attributes only
+        const root = document.documentElement;
+        search.textMayMatch = (
+            normalizeText(root ? root.textContent : '').includes(search.norm) ||
+            (document.body !== null && normalizeText(document.body.innerText).includes(search.norm))
+        );
+        const results = [];
+        syncCache();
+        
+        // Pass 1: one walk over the live element collection evaluating every
+        // match predicate and ranking by cheap signals (match score +
+        // interactive markup); no layout or style reads here
+        const allElements = document.getElementsByTagName('*');
+        // Candidates are kept as parallel arrays (no per-candidate object)
+        const candElements = [], candIndexes = [], candMatches = [], candScores = [];
+        let bestCount = 0;
+        
+        for (let index = 0; index < allElements.length; index++) {
+            const element = allElements[index];
+            const matches = checkElement(element, search);
+            if (matches.length === 0) continue;
+            
+            const interactiveHint = (
+                element.tagName.toLowerCase() in INTERACTIVE_TAGS ||
+                element.hasAttribute('onclick') || element.hasAttribute('href') || element.hasAttribute('tabindex')
+            );
+            const bestMatch = bestMatchScore(matches);
+            const cheapScore = (interactiveHint ? 5 : 0) + bestMatch / 10;
+            candElements.push(element);
+            candIndexes.push(index);
+            candMatches.push(matches);
+            candScores.push(cheapScore);
+            
+            // Once enough top-scoring candidates exist, nothing later in the
+            // document can displace them from the (stable) ranking below
+            if (cheapScore >= BEST_CHEAP_SCORE && ++bestCount >= MAX_LAYOUT_CANDIDATES) break;
+        }
+        
+        // Keep the top few: getBoundingClientRect/getComputedStyle force
+        // style and layout, so only these candidates pay for them
+        const order = candScores.map((_, i) => i);
+        order.sort((a, b) => candScores[b] - candScores[a]);
+        if (order.length > MAX_LAYOUT_CANDIDATES) order.length = MAX_LAYOUT_CANDIDATES;
+        
+        // Pass 2: layout/style reads only for the top candidates
+        for (const c of order) {
+            const element = candElements[c], index = candIndexes[c], matches = candMatches[c];
+            const rect = element.getBoundingClientRect();
+            const computedStyle = window.getComputedStyle(element);
+            
+            const isVisible = (
+                rect.width > 0 && 
+                rect.height > 0 && 
+                computedStyle.visibility !== 'hidden' && 
+                computedStyle.display !== 'none' &&
+                element.offsetParent !== null
+            );
+            
+            const isInteractive = (
+                element.tagName.toLowerCase() in INTERACTIVE_TAGS ||
+                element.onclick !== null ||
+                element.getAttribute('onclick') ||
+                element.getAttribute('href') ||
+                computedStyle.cursor === 'pointer' ||
+                element.hasAttribute('tabindex')
+            );
+            
+            const isClickable = (
+                isInteractive ||
+                element.addEventListener ||
+                computedStyle.pointerEvents !== 'none'
+            );
+            
+            results.push({
+                index: index,
+                tagName: element.tagName.toLowerCase(),
+                matches: matches,
+                bestMatch: bestMatchScore(matches),
+                selectors: generateSelector(element),
+                isVisible: isVisible,
+                isInteractive: isInteractive,
+                isClickable: isClickable,
+                position: {
+                    x: Math.round(rect.x),
+                    y: Math.round(rect.y),
+                    width: Math.round(rect.width),
+                    height: Math.round(rect.height)
+                },
+                styles: {
+                    display: computedStyle.display,
+                    visibility: computedStyle.visibility,
+                    cursor: computedStyle.cursor,
+                    pointerEvents: computedStyle.pointerEvents
+                },
+                textContent: element.textContent?.trim()?.substring(0, 100) || '',
+                innerHTML: element.innerHTML?.substring(0, 200) || '',
+                outerHTML: element.outerHTML?.substring(0, 300) || ''
+            });
+        }
+        
+        results.sort((a, b) => {
+            const scoreA = (a.isVisible ? 10 : 0) + (a.isInteractive ? 5 : 0) + (a.isClickable ? 3 : 0) + (a.bestMatch / 10);
+            const scoreB = (b.isVisible ? 10 : 0) + (b.isInteractive ? 5 : 0) + (b.isClickable ? 3 : 0) + (b.bestMatch / 10);
+            return scoreB - scoreA;
+        });
+        
+        // Fixed-order rows in one JSON string: Playwright ships a single string
+        // value instead of wrapping every key/value of every candidate
+        return JSON.stringify(results.map(r => [
+            r.index, r.tagName, r.matches, r.selectors,
+            r.isVisible, r.isInteractive, r.isClickable, r.position, r.styles,
+            r.textContent, r.innerHTML, r.outerHTML
+        ]));
+    };
+})();
+"""
+
+FIND_ELEMENTS_CALL = "(text) => window.__findElements ? window.__findElements(text) : null"
+
+# Repeat searches for the same text on an unchanged page skip the round-trip.
+# Keyed by (page identity, url, lowercased text); cleared after any action that
+# may change the DOM, and entries expire quickly to cover page-driven updates.
+FINDER_CACHE_TTL = 2.0
+FINDER_CACHE_SIZE = 64
+_FINDER_CACHE: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (stored_at, results)
 
 async def find_elements_with_text_live(page, text: str) -> List[Dict[str, Any]]:
     """
@@ -240,272 +767,71 @@ async def find_elements_with_text_live(page, text: str) -> List[Dict[str, Any]]:
     if not text:
         return []
     
-    escaped_text = text.replace('"', '\\"')
-    
-    js_search_script = f"""
-    (function() {{
-        const searchText = "{escaped_text}".toLowerCase();
-        const results = [];
-        
-        function normalizeText(text) {{
-            if (!text) return '';
-            return text.toLowerCase()
-                .replace(/[\\s_-]+/g, '')
-                .replace(/[^a-z0-9]/g, '');
-        }}
-        
-        function calculateMatchScore(searchNorm, targetNorm, originalTarget) {{
-            let score = 0;
-            
-            if (targetNorm === searchNorm) {{
-                score = 100;
-            }} else if (targetNorm.startsWith(searchNorm)) {{
-                score = 80;
-            }} else if (targetNorm.includes(searchNorm)) {{
-                score = 60;
-            }} else if (targetNorm.endsWith(searchNorm)) {{
-                score = 40;
-            }} else {{
-                return 0;
-            }}
-            
-            if (targetNorm.length === searchNorm.length) score += 20;
-            if (originalTarget.includes(' ') && searchText.includes(' ')) score += 10;
-            
-            return Math.min(score, 100);
-        }}
-        
-        function generateSelector(element) {{
-            const selectors = [];
-            
-            if (element.id) {{
-                selectors.push('#' + element.id);
-            }}
-            
-            if (element.className && typeof element.className === 'string') {{
-                const classes = element.className.trim().split(/\\s+/).filter(c => c.length > 0);
-                if (classes.length > 0) {{
-                    selectors.push('.' + classes.join('.'));
-                }}
-            }}
-            
-            for (let attr of element.attributes) {{
-                if (attr.name.startsWith('data-') && attr.value) {{
-                    selectors.push(`[${{attr.name}}="${{attr.value}}"]`);
-                }}
-            }}
-            
-            ['name', 'type', 'role', 'aria-label'].forEach(attrName => {{
-                const value = element.getAttribute(attrName);
-                if (value) {{
-                    selectors.push(`[${{attrName}}="${{value}}"]`);
-                }}
-            }});
-            
-            const textContent = element.textContent?.trim();
-            if (textContent && textContent.length > 0 && textContent.length < 50) {{
-                selectors.push(`text="${{textContent}}"`);
-                selectors.push(`:has-text("${{textContent}}")`);
-            }}
-            
-            selectors.push(element.tagName.toLowerCase());
-            
-            return selectors;
-        }}
-        
-        function checkElement(element) {{
-            const matches = [];
-            const searchNormalized = normalizeText(searchText);
-            
-            for (let attr of element.attributes) {{
-                const attrNameNorm = normalizeText(attr.name);
-                const attrValueNorm = normalizeText(attr.value);
-                
-                const nameScore = calculateMatchScore(searchNormalized, attrNameNorm, attr.name);
-                const valueScore = calculateMatchScore(searchNormalized, attrValueNorm, attr.value);
-                
-                if (nameScore > 0 || valueScore > 0) {{
-                    matches.push({{
-                        type: 'attribute',
-                        name: attr.name,
-                        value: attr.value,
-                        nameMatch: nameScore > 0,
-                        valueMatch: valueScore > 0,
-                        nameScore: nameScore,
-                        valueScore: valueScore,
-                        maxScore: Math.max(nameScore, valueScore)
-                    }});
-                }}
-            }}
-            
-            const textContent = element.textContent?.trim() || '';
-            const innerText = element.innerText?.trim() || '';
-            
-            const textContentNorm = normalizeText(textContent);
-            const textContentScore = calculateMatchScore(searchNormalized, textContentNorm, textContent);
-            
-            if (textContentScore > 0) {{
-                matches.push({{
-                    type: 'textContent',
-                    value: textContent,
-                    match: true,
-                    score: textContentScore
-                }});
-            }}
-            
-            if (innerText !== textContent) {{
-                const innerTextNorm = normalizeText(innerText);
-                const innerTextScore = calculateMatchScore(searchNormalized, innerTextNorm, innerText);
-                
-                if (innerTextScore > 0) {{
-                    matches.push({{
-                        type: 'innerText', 
-                        value: innerText,
-                        match: true,
-                        score: innerTextScore
-                    }});
-                }}
-            }}
-            
-            ['placeholder', 'value', 'title', 'alt', 'aria-label'].forEach(prop => {{
-                const value = element[prop] || element.getAttribute(prop);
-                if (value) {{
-                    const valueNorm = normalizeText(value);
-                    const propScore = calculateMatchScore(searchNormalized, valueNorm, value);
-                    
-                    if (propScore > 0) {{
-                        matches.push({{
-                            type: 'property',
-                            name: prop,
-                            value: value,
-                            match: true,
-                            score: propScore
-                        }});
-                    }}
-                }}
-            }});
-            
-            return matches;
-        }}
-        
-        const allElements = document.querySelectorAll('*');
-        
-        allElements.forEach((element, index) => {{
-            const matches = checkElement(element);
-            
-            if (matches.length > 0) {{
-                const rect = element.getBoundingClientRect();
-                const computedStyle = window.getComputedStyle(element);
-                
-                const isVisible = (
-                    rect.width > 0 && 
-                    rect.height > 0 && 
-                    computedStyle.visibility !== 'hidden' && 
-                    computedStyle.display !== 'none' &&
-                    element.offsetParent !== null
-                );
-                
-                const isInteractive = (
-                    element.tagName.toLowerCase() in {{'button': 1, 'a': 1, 'input': 1, 'select': 1, 'textarea': 1}} ||
-                    element.onclick !== null ||
-                    element.getAttribute('onclick') ||
-                    element.getAttribute('href') ||
-                    computedStyle.cursor === 'pointer' ||
-                    element.hasAttribute('tabindex')
-                );
-                
-                const isClickable = (
-                    isInteractive ||
-                    element.addEventListener ||
-                    computedStyle.pointerEvents !== 'none'
-                );
-                
-                results.push({{
-                    index: index,
-                    tagName: element.tagName.toLowerCase(),
-                    matches: matches,
-                    selectors: generateSelector(element),
-                    isVisible: isVisible,
-                    isInteractive: isInteractive,
-                    isClickable: isClickable,
-                    position: {{
-                        x: Math.round(rect.x),
-                        y: Math.round(rect.y),
-                        width: Math.round(rect.width),
-                        height: Math.round(rect.height)
-                    }},
-                    styles: {{
-                        display: computedStyle.display,
-                        visibility: computedStyle.visibility,
-                        cursor: computedStyle.cursor,
-                        pointerEvents: computedStyle.pointerEvents
-                    }},
-                    textContent: element.textContent?.trim()?.substring(0, 100) || '',
-                    innerHTML: element.innerHTML?.substring(0, 200) || '',
-                    outerHTML: element.outerHTML?.substring(0, 300) || ''
-                }});
-            }}
-        }});
-        
-        results.sort((a, b) => {{
-            const maxMatchScoreA = Math.max(...a.matches.map(m => m.score || 0), 0);
-            const maxMatchScoreB = Math.max(...b.matches.map(m => m.score || 0), 0);
-            
-            const scoreA = (a.isVisible ? 10 : 0) + (a.isInteractive ? 5 : 0) + (a.isClickable ? 3 : 0) + (maxMatchScoreA / 10);
-            const scoreB = (b.isVisible ? 10 : 0) + (b.isInteractive ? 5 : 0) + (b.isClickable ? 3 : 0) + (maxMatchScoreB / 10);
-            return scoreB - scoreA;
-        }});
-        
-        return results;
-    }})();
-    """
+    cache_key = (id(page), page.url, text.lower())
+    hit = _FINDER_CACHE.get(cache_key)
+    if hit and time.monotonic() - hit[0] < FINDER_CACHE_TTL:
+        _FINDER_CACHE.move_to_end(cache_key)
+        return hit[1]
     
     try:
-        results = await page.evaluate(js_search_script)
+        # ⚠️ One CDP round-trip per search: tag, visibility, selectors and bbox are
+        # all computed in the page script. Don't add per-element awaits
+        # (elem.evaluate / elem.is_visible) in the Python loop below.
+        raw = await page.evaluate(FIND_ELEMENTS_CALL, text)
+        if raw is None:
+            # First search in this document: install the finder, then call it
+            await page.evaluate(FIND_ELEMENTS_JS)
+            raw = await page.evaluate(FIND_ELEMENTS_CALL, text)
         
         processed_results = []
-        for result in results:
+        for (index, tag_name, matches, selectors, is_visible, is_interactive, is_clickable,
+             position, styles, text_content, inner_html, outer_html) in orjson.loads(raw):
             priority_score = 0
-            if result['isVisible']:
+            if is_visible:
                 priority_score += 10
-            if result['isInteractive']:
+            if is_interactive:
                 priority_score += 5
-            if result['isClickable']:
+            if is_clickable:
                 priority_score += 3
             
-            match_scores = [match.get('score', 0) for match in result['matches']]
+            # Same key as the in-page ranking: attribute matches only carry maxScore
+            match_scores = [match.get('score') or match.get('maxScore', 0) for match in matches]
             max_match_score = max(match_scores) if match_scores else 0
             priority_score += max_match_score / 10
             
             interaction_methods = []
-            if result['isClickable']:
+            if is_clickable:
                 interaction_methods.append('click')
-            if result['tagName'] in ['input', 'textarea']:
+            if tag_name in ['input', 'textarea']:
                 interaction_methods.append('fill')
                 interaction_methods.append('press')
-            if result['tagName'] == 'select':
+            if tag_name == 'select':
                 interaction_methods.append('selectOption')
             
             processed_result = {
-                'element_index': result['index'],
-                'tag_name': result['tagName'],
-                'matches': result['matches'],
-                'suggested_selectors': result['selectors'][:5],
-                'is_visible': result['isVisible'],
-                'is_interactive': result['isInteractive'],
-                'is_clickable': result['isClickable'],
-                'position': result['position'],
-                'styles': result['styles'],
+                'element_index': index,
+                'tag_name': tag_name,
+                'matches': matches,
+                'suggested_selectors': selectors[:5],
+                'is_visible': is_visible,
+                'is_interactive': is_interactive,
+                'is_clickable': is_clickable,
+                'position': position,
+                'styles': styles,
                 'interaction_methods': interaction_methods,
-                'text_content': result['textContent'],
-                'inner_html': result['innerHTML'],
-                'outer_html': result['outerHTML'],
+                'text_content': text_content,
+                'inner_html': inner_html,
+                'outer_html': outer_html,
                 'priority_score': priority_score,
-                'element_summary': f"{result['tagName']} ({'visible' if result['isVisible'] else 'hidden'}, {'interactive' if result['isInteractive'] else 'static'}) - {len(result['matches'])} matches",
+                'element_summary': f"{tag_name} ({'visible' if is_visible else 'hidden'}, {'interactive' if is_interactive else 'static'}) - {len(matches)} matches",
                 'all_attributes': {}
             }
             processed_results.append(processed_result)
         
+        _FINDER_CACHE[cache_key] = (time.monotonic(), processed_results)
+        _FINDER_CACHE.move_to_end(cache_key)
+        if len(_FINDER_CACHE) > FINDER_CACHE_SIZE:
+            _FINDER_CACHE.popitem(last=False)
         return processed_results
         
     except Exception as e:
@@ -513,199 +839,485 @@ async def find_elements_with_text_live(page, text: str) -> List[Dict[str, Any]]:
         return []
 
 # ==================== COST ANALYSIS ====================
-def save_analysis_report(analysis_data: dict):
-    """Save token usage analysis"""
+def format_cost_usd(nanodollars: int) -> str:
+    """Format an integer nanodollar amount as USD with 5 decimals"""
+    units = (nanodollars + NANODOLLARS_PER_CSV_UNIT // 2) // NANODOLLARS_PER_CSV_UNIT
+    return f"{units // 100_000}.{units % 100_000:05d}"
+
+def _save_analysis_report_sync(analysis_data: dict) -> list:
+    """Save token usage analysis JSON and return the report.csv row (worker thread)"""
     job_id = analysis_data["job_id"]
     provider = analysis_data["provider"]
     model = analysis_data["model"]
     
-    total_input = sum(step.get("input_tokens", 0) for step in analysis_data["steps"])
-    total_output = sum(step.get("output_tokens", 0) for step in analysis_data["steps"])
+    total_input = total_output = 0
+    for step in analysis_data["steps"]:
+        total_input += step.get("input_tokens", 0)
+        total_output += step.get("output_tokens", 0)
     
     analysis_data["total_input_tokens"] = total_input
     analysis_data["total_output_tokens"] = total_output
     
-    cost_info = TOKEN_COSTS.get(provider, {}).get(model)
-    if not cost_info and provider == "anthropic":
-        model_name_lower = model.lower()
-        if "sonnet" in model_name_lower:
-            cost_info = TOKEN_COSTS.get("anthropic", {}).get("claude-3-5-sonnet-20240620")
-        elif "haiku" in model_name_lower:
-            cost_info = TOKEN_COSTS.get("anthropic", {}).get("claude-3-haiku-20240307")
+    rates = _resolve_cost_rates(provider, model)
     
-    total_cost = 0.0
-    if cost_info:
-        input_cost = (total_input / 1_000_000) * cost_info["input"]
-        output_cost = (total_output / 1_000_000) * cost_info["output"]
-        total_cost = input_cost + output_cost
+    total_cost = 0
+    if rates:
+        input_rate, output_rate = rates
+        total_cost = total_input * input_rate + total_output * output_rate
     
-    analysis_data["total_cost_usd"] = f"{total_cost:.5f}"
+    analysis_data["total_cost_usd"] = format_cost_usd(total_cost)
     
     try:
-        ANALYSIS_DIR.mkdir(exist_ok=True)
         json_report_path = ANALYSIS_DIR / f"{job_id}.json"
-        with open(json_report_path, 'w') as f:
-            json.dump(analysis_data, f, indent=2)
+        with open(json_report_path, 'wb') as f:
+            f.write(orjson.dumps(analysis_data, option=orjson.OPT_INDENT_2))
     except Exception as e:
         logger.error(f"Error saving JSON analysis: {e}")
     
+    return [job_id, total_input, total_output, analysis_data["total_cost_usd"]]
+
+async def save_analysis_report(analysis_data: dict):
+    """Save token usage analysis off the event loop"""
+    row = await asyncio.to_thread(_save_analysis_report_sync, analysis_data)
+    # Buffered on the loop thread only; CSV rows are written by the flush task
+    _REPORT_ROWS.append(row)
+
+def _take_report_rows() -> list:
+    rows = _REPORT_ROWS[:]
+    _REPORT_ROWS.clear()
+    return rows
+
+def _write_report_rows(rows: list):
+    """Append report rows to the CSV in a single write"""
+    global _report_header_checked
     try:
-        file_exists = REPORT_CSV_FILE.is_file()
         with open(REPORT_CSV_FILE, 'a', newline='') as csvfile:
             writer = csv.writer(csvfile)
-            if not file_exists:
-                writer.writerow(['job_id', 'total_input_tokens', 'total_output_tokens', 'total_cost_usd'])
-            writer.writerow([job_id, total_input, total_output, f"{total_cost:.5f}"])
+            if not _report_header_checked:
+                if csvfile.tell() == 0:
+                    writer.writerow(REPORT_CSV_HEADER)
+                _report_header_checked = True
+            writer.writerows(rows)
     except Exception as e:
         logger.error(f"Error updating CSV report: {e}")
 
+def flush_report_rows():
+    """Synchronously write out any buffered report rows (used at shutdown)"""
+    if _REPORT_ROWS:
+        _write_report_rows(_take_report_rows())
+
+async def _report_flush_loop():
+    """Background writer for report.csv"""
+    while True:
+        await asyncio.sleep(REPORT_FLUSH_INTERVAL)
+        if _REPORT_ROWS:
+            await asyncio.to_thread(_write_report_rows, _take_report_rows())
+
+# ==================== CDP SESSIONS ====================
+SCREENSHOT_JPEG_QUALITY = 60
+SCREENSHOTS_DIR_STR = str(SCREENSHOTS_DIR)  # pre-joined for the screenshot endpoint
+SCREENSHOT_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+_CDP_SESSIONS: "weakref.WeakKeyDictionary[Page, Any]" = weakref.WeakKeyDictionary()
+
+# Starting Playwright spawns its driver process; do it once, not per job
+_PLAYWRIGHT = None
+_PLAYWRIGHT_LOCK = asyncio.Lock()
+
+async def get_playwright():
+    """Return the shared Playwright instance, starting it on first use"""
+    global _PLAYWRIGHT
+    async with _PLAYWRIGHT_LOCK:
+        if _PLAYWRIGHT is None:
+            _PLAYWRIGHT = await async_playwright().start()
+    return _PLAYWRIGHT
+
+def driver_gone(error: Exception) -> bool:
+    """Whether a Playwright call failed because its driver process died"""
+    # Once the driver pipe hits EOF, every call fails with this plain Exception
+    return isinstance(error, ConnectionError) or "Connection closed while reading from the driver" in str(error)
+
+async def discard_playwright(p):
+    """Drop a Playwright instance whose driver is gone; the next get_playwright restarts it"""
+    global _PLAYWRIGHT
+    async with _PLAYWRIGHT_LOCK:
+        if _PLAYWRIGHT is p:
+            _PLAYWRIGHT = None
+    try:
+        await asyncio.wait_for(p.stop(), timeout=5)
+    except Exception:
+        pass
+
+async def stop_playwright():
+    """Stop the shared Playwright driver, if it was started"""
+    global _PLAYWRIGHT
+    async with _PLAYWRIGHT_LOCK:
+        if _PLAYWRIGHT is not None:
+            await _PLAYWRIGHT.stop()
+            _PLAYWRIGHT = None
+
+def index_job_screenshots(job_id: str):
+    """Stat a finished job's screenshots once so the endpoint can skip stat()"""
+    try:
+        with os.scandir(f"{SCREENSHOTS_DIR_STR}/{job_id}") as entries:
+            SCREENSHOT_INDEX[job_id] = {
+                e.name: e.stat() for e in entries if e.is_file(follow_symlinks=False)
+            }
+    except OSError:
+        pass
+
+async def get_cdp_session(page: Page):
+    """Return a raw CDP session for the page, created once and reused"""
+    session = _CDP_SESSIONS.get(page)
+    if session is None:
+        session = await page.context.new_cdp_session(page)
+        _CDP_SESSIONS[page] = session
+    return session
+
+# Screenshot files being written in worker threads, by job artifacts dir;
+# the LLM call gets the base64 directly and does not wait for the disk
+_SCREENSHOT_WRITES: Dict[Path, set] = {}
+
+def _write_screenshot(path: Path, data_b64: str):
+    try:
+        path.write_bytes(base64.b64decode(data_b64))
+    except OSError as e:
+        logger.warning(f"Could not save screenshot {path}: {e}")
+
+async def wait_for_screenshot_writes(job_dir: Path):
+    """Wait until every screenshot handed off for this job dir is on disk"""
+    writes = _SCREENSHOT_WRITES.get(job_dir)
+    if writes:
+        await asyncio.gather(*list(writes), return_exceptions=True)
+
+def _screenshot_write_done(job_dir: Path, write: asyncio.Task):
+    writes = _SCREENSHOT_WRITES.get(job_dir)
+    if writes is not None:
+        writes.discard(write)
+        if not writes:
+            del _SCREENSHOT_WRITES[job_dir]
+
+async def capture_screenshot_jpeg(page: Page, path: Path, timeout: float = 5.0) -> str:
+    """Viewport screenshot straight from the renderer as JPEG; returns its base64"""
+    cdp = await get_cdp_session(page)
+    data = await asyncio.wait_for(
+        cdp.send("Page.captureScreenshot", {
+            "format": "jpeg",
+            "quality": SCREENSHOT_JPEG_QUALITY,
+            "captureBeyondViewport": False
+        }),
+        timeout=timeout
+    )
+    write = asyncio.create_task(asyncio.to_thread(_write_screenshot, path, data["data"]))
+    _SCREENSHOT_WRITES.setdefault(path.parent, set()).add(write)
+    write.add_done_callback(partial(_screenshot_write_done, path.parent))
+    return data["data"]
+
 # ==================== POPUP KILLER ====================
-async def install_popup_killer(page):
-    """
-    🛡️ PROACTIVE POPUP KILLER - MutationObserver-based instant removal
-    Runs in browser context with zero Python overhead
-    """
-    popup_killer_script = """
-    (function() {
-        const DISMISS_TEXTS = [
-            "accept", "accept all", "accept cookies", "agree", "agree and continue",
-            "i accept", "i agree", "ok", "okay", "yes", "allow", "allow all",
-            "got it", "understood", "sounds good", "close", "dismiss", "no thanks",
-            "not now", "maybe later", "later", "skip", "skip for now", "remind me later",
-            "not interested", "continue", "proceed", "next", "go ahead", "let's go",
-            "decline", "reject", "refuse", "no", "cancel", "don't show again",
-            "do not show", "only necessary", "necessary only", "essential only",
-            "reject all", "decline all", "manage preferences", "continue without",
-            "skip sign in", "skip login", "browse as guest", "continue as guest",
-            "no account", "no thank you", "unsubscribe", "don't subscribe",
-            "×", "✕", "✖", "⨯", "close dialog", "close modal", "close popup",
-            "dismiss notification", "close banner", "close alert"
-        ];
-        
-        const POPUP_SELECTORS = [
-            "[role='dialog']", "[role='alertdialog']", ".modal", ".popup", 
-            ".overlay", ".lightbox", ".dialog", "#cookie-banner", ".cookie-banner",
-            "[class*='cookie']", "#cookieConsent", ".cookie-consent", "[id*='cookie']",
-            ".overlay-wrapper", ".modal-backdrop", ".popup-overlay", "[class*='overlay']",
-            "[class*='backdrop']", ".newsletter-popup", ".subscription-modal",
-            "[class*='newsletter']", ".close-btn", ".close-button", "[aria-label*='close']",
-            "[aria-label*='dismiss']", "button.close", ".modal-close"
-        ];
-        
-        let processedElements = new WeakSet();
-        let killCount = 0;
-        
-        function normalizeText(text) {
-            return text.toLowerCase().trim().replace(/\\s+/g, ' ');
-        }
-        
-        function tryKillPopup(element) {
-            if (!element || processedElements.has(element)) return false;
-            processedElements.add(element);
-            
-            const style = window.getComputedStyle(element);
-            if (style.display === 'none' || style.visibility === 'hidden') return false;
-            
-            const clickables = element.querySelectorAll('button, a, [role="button"], [onclick]');
-            for (const btn of clickables) {
-                const text = normalizeText(btn.textContent || btn.innerText || '');
-                const ariaLabel = normalizeText(btn.getAttribute('aria-label') || '');
-                
-                for (const dismissText of DISMISS_TEXTS) {
-                    if (text.includes(dismissText) || ariaLabel.includes(dismissText)) {
-                        try {
-                            btn.click();
-                            killCount++;
-                            console.log(`🎯 Popup killed #${killCount}: clicked "${btn.textContent}" in`, element);
-                            return true;
-                        } catch (e) {
-                            continue;
-                        }
-                    }
-                }
+# 🛡️ PROACTIVE POPUP KILLER - MutationObserver-based instant removal.
+# Evaluated into the page's isolated world (out of sight of the site's own
+# scripts) and re-injected on every domcontentloaded of the main frame.
+POPUP_KILLER_JS = """
+(function() {
+    // Once per document: a re-injection into the same document is a no-op
+    if (window.__popupKillCount) return;
+    
+    const DISMISS_TEXTS = [
+        "accept", "accept all", "accept cookies", "agree", "agree and continue",
+        "i accept", "i agree", "ok", "okay", "yes", "allow", "allow all",
+        "got it", "understood", "sounds good", "close", "dismiss", "no thanks",
+        "not now", "maybe later", "later", "skip", "skip for now", "remind me later",
+        "not interested", "continue", "proceed", "next", "go ahead", "let's go",
+        "decline", "reject", "refuse", "no", "cancel", "don't show again",
+        "do not show", "only necessary", "necessary only", "essential only",
+        "reject all", "decline all", "manage preferences", "continue without",
+        "skip sign in", "skip login", "browse as guest", "continue as guest",
+        "no account", "no thank you", "unsubscribe", "don't subscribe",
+        "×", "✕", "✖", "⨯", "close dialog", "close modal", "close popup",
+        "dismiss notification", "close banner", "close alert"
+    ];
+    const DISMISS_SET = new Set(DISMISS_TEXTS);
+    // One alternation instead of a substring scan per phrase; no 'g' flag
+    // so test() keeps no lastIndex state between calls
+    const DISMISS_RE = new RegExp(
+        DISMISS_TEXTS.map(t => t.replace(/[.*+?^${}()|[\\]\\\\]/g, '\\\\$&')).join('|'), 'i'
+    );
+    
+    function isDismissText(text) {
+        // Most dismiss buttons are labelled with exactly one phrase
+        return DISMISS_SET.has(text) || DISMISS_RE.test(text);
+    }
+    
+    const POPUP_SELECTORS = [
+        "[role='dialog']", "[role='alertdialog']", ".modal", ".popup", 
+        ".overlay", ".lightbox", ".dialog", "#cookie-banner", ".cookie-banner",
+        "[class*='cookie']", "#cookieConsent", ".cookie-consent", "[id*='cookie']",
+        ".overlay-wrapper", ".modal-backdrop", ".popup-overlay", "[class*='overlay']",
+        "[class*='backdrop']", ".newsletter-popup", ".subscription-modal",
+        "[class*='newsletter']", ".close-btn", ".close-button", "[aria-label*='close']",
+        "[aria-label*='dismiss']", "button.close", ".modal-close"
+    ];
+    // One selector list so each scan walks the DOM once, in document order
+    const ALL_POPUPS_SELECTOR = POPUP_SELECTORS.join(',');
+    // Ids of the common consent managers' banners: getElementById is a
+    // hash lookup, so these are tried before the full selector walk
+    const KNOWN_POPUP_IDS = [
+        "cookie-banner", "cookieConsent", "onetrust-banner-sdk",
+        "CybotCookiebotDialog", "gdpr-banner"
+    ];
+    
+    // Only buttons that were actually clicked are skipped later, so a popup
+    // that could not be dismissed on first sight is retried on rescans
+    const clickedButtons = new WeakSet();
+    let killCount = 0;
+    // Every console call is forwarded over CDP; set window.__popupKillerDebug to trace kills
+    const debugLog = (...args) => { if (window.__popupKillerDebug) console.log(...args); };
+    
+    function collapseText(text) {
+        return text.toLowerCase().trim().replace(/\\s+/g, ' ');
+    }
+    
+    // Most button labels are already lowercase single-spaced ASCII; one
+    // charCode scan returns those as-is and only the rest pay for the
+    // lowercase/trim/collapse chain and its three string allocations
+    function normalizeText(text) {
+        let prevSpace = true;
+        for (let i = 0; i < text.length; i++) {
+            const c = text.charCodeAt(i);
+            if (c === 32) {
+                if (prevSpace) return collapseText(text);
+                prevSpace = true;
+            } else if (c < 32 || c > 126 || (c >= 65 && c <= 90)) {
+                return collapseText(text);
+            } else {
+                prevSpace = false;
             }
+        }
+        return prevSpace && text.length ? collapseText(text) : text;
+    }
+    
+    // Normalized button text, reused across scans until the subtree's
+    // text changes (see textObserver below)
+    const textCache = new WeakMap();
+    function cachedText(el) {
+        let v = textCache.get(el);
+        if (v === undefined) {
+            v = normalizeText(el.textContent || el.innerText || '');
+            textCache.set(el, v);
+        }
+        return v;
+    }
+    
+    function clickDismissIn(element, clickables) {
+        for (const btn of clickables) {
+            if (clickedButtons.has(btn)) continue;
+            const text = cachedText(btn);
+            const ariaLabel = normalizeText(btn.getAttribute('aria-label') || '');
             
-            if (element.tagName === 'BUTTON' || element.getAttribute('role') === 'button') {
-                const text = normalizeText(element.textContent || '');
-                for (const dismissText of DISMISS_TEXTS) {
-                    if (text.includes(dismissText)) {
-                        try {
-                            element.click();
-                            killCount++;
-                            console.log(`🎯 Popup killed #${killCount}: direct click`, element);
-                            return true;
-                        } catch (e) {}
-                    }
+            if (isDismissText(text) || isDismissText(ariaLabel)) {
+                try {
+                    btn.click();
+                    clickedButtons.add(btn);
+                    killCount++;
+                    debugLog(`🎯 Popup killed #${killCount}: clicked "${btn.textContent}" in`, element);
+                    return true;
+                } catch (e) {
+                    continue;
                 }
             }
-            
-            return false;
+        }
+        return false;
+    }
+    
+    function isShown(element) {
+        const style = window.getComputedStyle(element);
+        return style.display !== 'none' && style.visibility !== 'hidden';
+    }
+    
+    function tryKillPopup(element) {
+        if (!element || !isShown(element)) return false;
+        return killWithin(element);
+    }
+    
+    function killWithin(element) {
+        // Most dismiss targets are <button>s: try the cheap tag collection
+        // first and only run the selector engine when none of them matched
+        if (clickDismissIn(element, element.getElementsByTagName('button')) ||
+            clickDismissIn(element, element.querySelectorAll('a, [role="button"], [onclick]'))) {
+            return true;
         }
         
-        function scanAndKill() {
-            for (const selector of POPUP_SELECTORS) {
+        if ((element.tagName === 'BUTTON' || element.getAttribute('role') === 'button') &&
+            !clickedButtons.has(element)) {
+            const text = cachedText(element);
+            if (isDismissText(text)) {
                 try {
-                    const popups = document.querySelectorAll(selector);
-                    for (const popup of popups) {
-                        if (tryKillPopup(popup)) return;
-                    }
+                    element.click();
+                    clickedButtons.add(element);
+                    killCount++;
+                    debugLog(`🎯 Popup killed #${killCount}: direct click`, element);
+                    return true;
                 } catch (e) {}
             }
         }
         
-        scanAndKill();
-        
-        const observer = new MutationObserver((mutations) => {
-            let hasRelevantMutation = false;
-            
-            for (const mutation of mutations) {
-                if (mutation.type === 'childList' && mutation.addedNodes.length > 0) {
-                    for (const node of mutation.addedNodes) {
-                        if (node.nodeType === 1) {
-                            const tag = node.tagName?.toLowerCase();
-                            const classes = node.className?.toLowerCase() || '';
-                            const id = node.id?.toLowerCase() || '';
-                            
-                            if (tag === 'dialog' || 
-                                classes.includes('modal') || 
-                                classes.includes('popup') || 
-                                classes.includes('overlay') ||
-                                classes.includes('cookie') ||
-                                id.includes('cookie') ||
-                                id.includes('modal')) {
-                                hasRelevantMutation = true;
-                                if (tryKillPopup(node)) return;
-                            }
+        return false;
+    }
+    
+    function scanAndKill() {
+        lastScan = Date.now();
+        try {
+            for (const id of KNOWN_POPUP_IDS) {
+                if (tryKillPopup(document.getElementById(id))) return;
+            }
+            const popups = document.querySelectorAll(ALL_POPUPS_SELECTOR);
+            // The NodeList is already unique and in document order, but
+            // overlapping selectors match nested containers (a .modal inside
+            // an overlay). Once a shown container's buttons were checked,
+            // its descendants offer no new dismiss target, so skip them
+            let covered = null;
+            for (const popup of popups) {
+                if (covered && covered.contains(popup)) continue;
+                if (!isShown(popup)) continue;
+                covered = popup;
+                if (killWithin(popup)) return;
+            }
+        } catch (e) {}
+    }
+    
+    // Full scans only run when nodes were added since the last one, at most
+    // once per MIN_SCAN_INTERVAL, and bursts of mutations coalesce into a
+    // single idle-time callback
+    const MIN_SCAN_INTERVAL = 1000;  // ms
+    const idle = window.requestIdleCallback || ((cb) => setTimeout(cb, 50));
+    let dirty = false;
+    let scheduled = false;
+    let lastScan = 0;
+    let rescanTimer = null;
+    // Popup-looking nodes queued by the observer; their style and text
+    // checks run in the idle callback, not inside the mutation callback
+    const pendingNodes = new Set();
+    
+    function schedule() {
+        if (scheduled) return;
+        scheduled = true;
+        idle(() => {
+            scheduled = false;
+            const nodes = [...pendingNodes];
+            pendingNodes.clear();
+            for (const node of nodes) {
+                if (node.isConnected && tryKillPopup(node)) break;
+            }
+            if (!dirty) return;
+            const wait = lastScan + MIN_SCAN_INTERVAL - Date.now();
+            if (wait <= 0) {
+                dirty = false;
+                scanAndKill();
+            } else if (rescanTimer === null) {
+                // Busy page: stay dirty and scan once the interval is up
+                rescanTimer = setTimeout(() => {
+                    rescanTimer = null;
+                    schedule();
+                }, wait);
+            }
+        }, { timeout: 500 });
+    }
+    
+    function isCandidateOverlay(element) {
+        return element.tagName === 'DIALOG' ||
+            KNOWN_POPUP_IDS.includes(element.id) ||
+            element.matches(ALL_POPUPS_SELECTOR);
+    }
+    
+    const observer = new MutationObserver((mutations) => {
+        let queued = false;
+        for (const mutation of mutations) {
+            if (mutation.type === 'attributes') {
+                // Animations and carousels restyle other elements every
+                // frame; only a candidate overlay being shown matters, and
+                // it is checked on its own rather than by a full scan
+                if (isCandidateOverlay(mutation.target)) {
+                    pendingNodes.add(mutation.target);
+                    queued = true;
+                }
+            } else if (mutation.addedNodes.length > 0) {
+                for (const node of mutation.addedNodes) {
+                    if (node.nodeType === 1) {
+                        dirty = true;
+                        const tag = node.tagName?.toLowerCase();
+                        // SVG elements carry an SVGAnimatedString className
+                        const classes = typeof node.className === 'string' ? node.className.toLowerCase() : '';
+                        const id = node.id?.toLowerCase() || '';
+                        
+                        if (tag === 'dialog' || 
+                            classes.includes('modal') || 
+                            classes.includes('popup') || 
+                            classes.includes('overlay') ||
+                            classes.includes('cookie') ||
+                            id.includes('cookie') ||
+                            id.includes('modal')) {
+                            pendingNodes.add(node);
                         }
                     }
                 }
             }
-            
-            if (hasRelevantMutation) {
-                setTimeout(scanAndKill, 50);
-            }
-        });
+        }
         
+        if (dirty || queued) schedule();
+    });
+    
+    // Any text or child change drops cached text for the node and its ancestors
+    const textObserver = new MutationObserver((mutations) => {
+        for (const mutation of mutations) {
+            for (let node = mutation.target; node; node = node.parentNode) {
+                textCache.delete(node);
+            }
+        }
+    });
+    
+    function start() {
+        scanAndKill();
+        // Popups shown by toggling class/style/open on an overlay count as
+        // changes too, since there is no periodic rescan to pick them up
         observer.observe(document.body, {
             childList: true,
             subtree: true,
-            attributes: false,
+            attributes: true,
+            attributeFilter: ['class', 'style', 'open', 'hidden'],
             characterData: false
         });
-        
-        setInterval(scanAndKill, 2000);
-        
-        console.log('🛡️ Popup killer installed and monitoring...');
-        
-        window.__popupKillCount = () => killCount;
-    })();
-    """
+        textObserver.observe(document.body, {
+            childList: true,
+            subtree: true,
+            characterData: true
+        });
+        debugLog('🛡️ Popup killer installed and monitoring...');
+    }
     
-    try:
-        await page.evaluate(popup_killer_script)
-        logger.info("🛡️ Proactive popup killer installed")
-    except Exception as e:
-        logger.warning(f"⚠️ Failed to install popup killer: {e}")
+    // about:blank and some XHTML documents have no <body> yet
+    if (document.body) {
+        start();
+    } else {
+        document.addEventListener('DOMContentLoaded', start, { once: true });
+    }
+    
+    window.__popupKillCount = () => killCount;
+})();
+"""
+
+async def install_popup_killer(page):
+    """Inject the popup killer now and again after every main-frame navigation"""
+    async def inject(_=None):
+        try:
+            await page.evaluate(POPUP_KILLER_JS)
+        except Exception as e:
+            logger.debug(f"Popup killer injection skipped: {e}")
+
+    # No add_init_script: patchright backs it with a catch-all route, which
+    # sends every request through Python and turns off the HTTP cache
+    page.on("domcontentloaded", inject)
+    await inject()
+    logger.info("🛡️ Proactive popup killer installed")
 
 # ==================== API MODELS ====================
 class SearchRequest(BaseModel):
@@ -725,7 +1337,8 @@ class UserInputResponse(BaseModel):
     input_value: str
 
 # ==================== AGENT STATE ====================
-class AgentState(TypedDict):
+@dataclass(slots=True)
+class AgentState:
     job_id: str
     browser: Browser
     page: Page
@@ -742,7 +1355,10 @@ class AgentState(TypedDict):
     history: List[str]
     token_usage: List[dict]
     found_element_context: dict
-    failed_actions: Dict[str, int]
+    found_element_context_version: int  # bumped on every write of found_element_context
+    element_context_lines: List[str]  # rendered prompt block for element_context_lines_version
+    element_context_lines_version: int
+    failed_actions: Counter  # action signature -> failure count
     attempted_action_signatures: List[str]
     waiting_for_user_input: bool
     user_input_request: dict
@@ -927,6 +1543,98 @@ class AgentState(TypedDict):
 #     return state
 
 
+# Every element CAPTCHA detection looks for, by name. CAPTCHA_DETECT_JS
+# walks the DOM once for their union; if none of it is in the DOM there is
+# nothing to detect
+CAPTCHA_CHECKS = {
+    "recaptcha_frame": 'iframe[src*="recaptcha"]',
+    "recaptcha_visible": 'iframe[src*="recaptcha"][style*="visible"]',
+    "recaptcha_checkbox": '.recaptcha-checkbox:not([aria-checked="true"])',
+    "recaptcha_challenge": '.rc-imageselect-target',
+    "hcaptcha_frame": 'iframe[src*="hcaptcha"]',
+    "hcaptcha_response": '[data-hcaptcha-response]',
+    "cf_challenge_running": '.cf-challenge-running',
+    "cf_challenge_legacy": '#challenge-running',
+    "turnstile_frame": 'iframe[src*="turnstile"]',
+    "generic": '[class*="captcha"], [id*="captcha"]',
+}
+CAPTCHA_PRESENCE_SELECTOR = ", ".join(CAPTCHA_CHECKS.values())
+
+# Called with CAPTCHA_CHECKS. `detected`/`type`/`details` are the strict
+# verdict used by the agent graph; `types` lists every CAPTCHA kind with
+# any element on the page (smart_captcha_check)
+CAPTCHA_DETECT_JS = """
+(checks) => {
+    const hit = {};
+    const entries = Object.entries(checks);
+    for (const el of document.querySelectorAll(Object.values(checks).join(', '))) {
+        for (const [name, selector] of entries) {
+            if (!hit[name] && el.matches(selector)) hit[name] = true;
+        }
+    }
+    
+    const groups = {
+        recaptcha: {
+            visible: !!hit.recaptcha_visible,
+            checkbox: !!hit.recaptcha_checkbox,
+            challenge: !!hit.recaptcha_challenge
+        },
+        hcaptcha: {
+            visible: !!hit.hcaptcha_frame,
+            checkbox: !!hit.hcaptcha_response
+        },
+        cloudflare: {
+            challenge: !!hit.cf_challenge_running,
+            turnstile: !!hit.turnstile_frame
+        }
+    };
+    let detected = null;
+    for (const name of ['recaptcha', 'hcaptcha', 'cloudflare']) {
+        if (Object.values(groups[name]).some(v => v)) {
+            detected = name;
+            break;
+        }
+    }
+    
+    const present = {
+        recaptcha: !!hit.recaptcha_frame,
+        hcaptcha: !!hit.hcaptcha_frame,
+        cloudflare: !!(hit.cf_challenge_running || hit.cf_challenge_legacy),
+        turnstile: !!hit.turnstile_frame,
+        generic: !!hit.generic
+    };
+    
+    return {
+        detected: !!detected,
+        type: detected,
+        details: detected ? groups[detected] : null,
+        types: Object.keys(present).filter(k => present[k]),
+        timestamp: Date.now()
+    };
+}
+"""
+
+async def wait_for_captcha(page, timeout_ms: int) -> Dict[str, Any]:
+    """Wait up to timeout_ms for a CAPTCHA element, then run CAPTCHA_DETECT_JS.
+    
+    Returns as soon as a CAPTCHA element is attached instead of after a
+    fixed sleep. Network idle is not a stop signal: after a click that
+    does not navigate, the old document's networkidle is already reached
+    and would end the wait before the CAPTCHA loads. The DOM is always
+    checked once before reporting "no CAPTCHA".
+    """
+    try:
+        await page.wait_for_selector(CAPTCHA_PRESENCE_SELECTOR, state="attached", timeout=timeout_ms)
+    except PlaywrightTimeoutError:
+        pass
+    return await page.evaluate(CAPTCHA_DETECT_JS, CAPTCHA_CHECKS)
+
+
+# Clicks/presses on these selectors are the ones likely to trigger a CAPTCHA
+_CRITICAL_SELECTOR_RE = _compile_phrases([
+    'submit', 'login', 'signin', 'register', 'signup', 'continue'
+])
+
 async def captcha_handler_node(state: AgentState) -> AgentState:
     """
     🤖 SMART CAPTCHA DETECTOR - Proactive detection with LLM guidance
@@ -934,9 +1642,9 @@ async def captcha_handler_node(state: AgentState) -> AgentState:
     Instead of trying to solve automatically (which keeps failing),
     this node DETECTS CAPTCHAs and prepares context for the LLM to decide.
     """
-    job_id = state['job_id']
-    page = state['page']
-    last_action = state['last_action']
+    job_id = state.job_id
+    page = state.page
+    last_action = state.last_action
     action_type = last_action.get('type', '')
     
     # Skip if LLM just explicitly solved CAPTCHA
@@ -953,11 +1661,8 @@ async def captcha_handler_node(state: AgentState) -> AgentState:
         context = "navigation"
         wait_time = 1500
     elif action_type in ["click", "press"]:
-        selector = last_action.get('selector', '').lower()
-        critical = any(kw in selector for kw in [
-            'submit', 'login', 'signin', 'register', 'signup', 'continue'
-        ])
-        if critical:
+        selector = last_action.get('selector', '')
+        if _CRITICAL_SELECTOR_RE.search(selector):
             should_check = True
             context = "post_critical_action"
             wait_time = 2000
@@ -966,81 +1671,41 @@ async def captcha_handler_node(state: AgentState) -> AgentState:
         return state
     
     try:
-        logger.info(f"🔍 CAPTCHA detection: {context} (wait {wait_time}ms)")
-        await page.wait_for_timeout(wait_time)
-        
+        logger.debug(f"🔍 CAPTCHA detection: {context} (wait up to {wait_time}ms)")
         # Quick CAPTCHA detection (don't solve, just detect)
-        captcha_check = await page.evaluate("""
-            () => {
-                const checks = {
-                    recaptcha: {
-                        visible: !!document.querySelector('iframe[src*="recaptcha"][style*="visible"]'),
-                        checkbox: !!document.querySelector('.recaptcha-checkbox:not([aria-checked="true"])'),
-                        challenge: !!document.querySelector('.rc-imageselect-target')
-                    },
-                    hcaptcha: {
-                        visible: !!document.querySelector('iframe[src*="hcaptcha"]'),
-                        checkbox: !!document.querySelector('[data-hcaptcha-response]')
-                    },
-                    cloudflare: {
-                        challenge: !!document.querySelector('.cf-challenge-running'),
-                        turnstile: !!document.querySelector('iframe[src*="turnstile"]')
-                    }
-                };
-                
-                let detected = null;
-                let details = null;
-                
-                if (checks.recaptcha.visible || checks.recaptcha.checkbox || checks.recaptcha.challenge) {
-                    detected = 'recaptcha';
-                    details = checks.recaptcha;
-                } else if (checks.hcaptcha.visible || checks.hcaptcha.checkbox) {
-                    detected = 'hcaptcha';
-                    details = checks.hcaptcha;
-                } else if (checks.cloudflare.challenge || checks.cloudflare.turnstile) {
-                    detected = 'cloudflare';
-                    details = checks.cloudflare;
-                }
-                
-                return {
-                    detected: !!detected,
-                    type: detected,
-                    details: details,
-                    timestamp: Date.now()
-                };
-            }
-        """)
+        captcha_check = await wait_for_captcha(page, wait_time)
         
         if captcha_check['detected']:
             captcha_type = captcha_check['type']
             logger.warning(f"⚠️ CAPTCHA DETECTED: {captcha_type} ({context})")
             
             # Add to history with CLEAR guidance for LLM
-            state['history'].append(
-                f"Step {state['step']}: 🚨 CAPTCHA DETECTED: {captcha_type.upper()}"
+            state.history.append(
+                f"Step {state.step}: 🚨 CAPTCHA DETECTED: {captcha_type.upper()}"
             )
-            state['history'].append(
-                f"Step {state['step']}: 💡 NEXT ACTION: Use {{'type': 'solve_captcha'}} to solve it"
+            state.history.append(
+                f"Step {state.step}: 💡 NEXT ACTION: Use {{'type': 'solve_captcha'}} to solve it"
             )
             
             # Store CAPTCHA context for LLM
-            state['found_element_context'] = {
+            state.found_element_context = {
                 "captcha_detected": True,
                 "captcha_type": captcha_type,
                 "captcha_details": captcha_check['details'],
-                "detected_at_step": state['step'],
+                "detected_at_step": state.step,
                 "guidance": f"A {captcha_type} CAPTCHA is blocking progress. Use solve_captcha action to resolve it before proceeding."
             }
+            state.found_element_context_version += 1
             
             push_status(job_id, "captcha_detected", {
                 "type": captcha_type,
                 "context": context,
-                "step": state['step'],
+                "step": state.step,
                 "llm_action_required": True
             })
             
         else:
-            logger.info(f"✅ No CAPTCHA detected ({context})")
+            logger.debug(f"✅ No CAPTCHA detected ({context})")
             
     except Exception as e:
         logger.error(f"❌ CAPTCHA detection error: {e}")
@@ -1051,23 +1716,17 @@ async def captcha_handler_node(state: AgentState) -> AgentState:
 async def navigate_to_page(state: AgentState) -> AgentState:
     """🌐 NAVIGATION with Smart CAPTCHA Handling"""
     try:
-        logger.info(f"🌐 Navigating to: {state['query']}")
-        await state['page'].goto(state['query'], wait_until='domcontentloaded', timeout=60000)
-        
-        # 🛡️ Install popup killer
-        try:
-            await install_popup_killer(state['page'])
-        except Exception as e:
-            logger.warning(f"⚠️ Popup killer failed: {e}")
+        logger.info(f"🌐 Navigating to: {state.query}")
+        await state.page.goto(state.query, wait_until='domcontentloaded', timeout=60000)
         
         # 🤖 SMART CAPTCHA CHECK on navigation
         logger.info("🤖 Checking for navigation CAPTCHAs...")
-        captcha_result = await smart_captcha_check(state['page'], state['job_id'], context="navigation")
+        captcha_result = await smart_captcha_check(state.page, state.job_id, context="navigation")
         
         if captcha_result["detected"]:
             if captcha_result["solved"]:
-                push_status(state['job_id'], "captcha_handled", {
-                    "url": state['query'],
+                push_status(state.job_id, "captcha_handled", {
+                    "url": state.query,
                     "context": "navigation",
                     "type": captcha_result['type'],
                     "method": captcha_result['method']
@@ -1076,11 +1735,11 @@ async def navigate_to_page(state: AgentState) -> AgentState:
             else:
                 logger.warning(f"⚠️ Navigation CAPTCHA failed: {captcha_result.get('error')}")
         
-        push_status(state['job_id'], "navigation_complete", {"url": state['query']})
+        push_status(state.job_id, "navigation_complete", {"url": state.query})
         logger.info(f"✅ Navigation completed")
         
     except Exception as e:
-        push_status(state['job_id'], "navigation_failed", {"url": state['query'], "error": str(e)})
+        push_status(state.job_id, "navigation_failed", {"url": state.query, "error": str(e)})
         logger.error(f"❌ Navigation failed: {e}")
     
     return state
@@ -1122,32 +1781,29 @@ async def smart_captcha_check(page, job_id: str, context: str = "general"):
     
     try:
         # ⏱️ STEP 1: Give page time to auto-solve CAPTCHA
-        logger.info(f"🤖 Waiting {initial_wait}ms for potential auto-CAPTCHA solve ({context})...")
-        await page.wait_for_timeout(initial_wait)
+        logger.info(f"🤖 Waiting up to {initial_wait}ms for potential auto-CAPTCHA solve ({context})...")
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        present = await wait_for_captcha(page, initial_wait)
         result["waited"] = True
         
+        if not present["types"]:
+            logger.info("✅ No CAPTCHA detected or auto-solved successfully")
+            result["auto_solved"] = True
+            return result
+        
+        # A CAPTCHA is in the DOM: use the rest of the window to let it clear
+        remaining = initial_wait - (loop.time() - started) * 1000
+        if remaining > 0:
+            try:
+                await page.wait_for_selector(CAPTCHA_PRESENCE_SELECTOR, state="detached", timeout=remaining)
+            except PlaywrightTimeoutError:
+                pass
+        
         # 🔍 STEP 2: Quick check - is CAPTCHA still visible?
-        captcha_indicators = await page.evaluate("""
-            () => {
-                // Check for common CAPTCHA iframes/elements
-                const checks = {
-                    recaptcha: !!document.querySelector('iframe[src*="recaptcha"]'),
-                    hcaptcha: !!document.querySelector('iframe[src*="hcaptcha"]'),
-                    cloudflare: !!document.querySelector('.cf-challenge-running') || 
-                                !!document.querySelector('#challenge-running'),
-                    turnstile: !!document.querySelector('iframe[src*="turnstile"]'),
-                    generic: !!document.querySelector('[class*="captcha"]') || 
-                             !!document.querySelector('[id*="captcha"]')
-                };
-                
-                return {
-                    detected: Object.values(checks).some(v => v),
-                    types: Object.entries(checks).filter(([k,v]) => v).map(([k]) => k)
-                };
-            }
-        """)
+        captcha_indicators = await page.evaluate(CAPTCHA_DETECT_JS, CAPTCHA_CHECKS)
         
-        if not captcha_indicators["detected"]:
+        if not captcha_indicators["types"]:
             logger.info("✅ No CAPTCHA detected or auto-solved successfully")
             result["auto_solved"] = True
             return result
@@ -1197,30 +1853,107 @@ async def smart_captcha_check(page, job_id: str, context: str = "general"):
 
 
 
+# Fixed pieces of the per-step history prompt, built once
+_BAR_EQ = "=" * 70
+_BAR_DASH = "─" * 70
+_ELEMENT_CONTEXT_HEADER = (
+    _BAR_EQ,
+    "🎯 ELEMENT SEARCH RESULTS FROM PREVIOUS STEP - USE THESE NOW!",
+    _BAR_EQ,
+)
+_ELEMENT_CONTEXT_FOOTER = (
+    _BAR_EQ,
+    "🚨 CRITICAL: Use above selectors immediately. DO NOT search again!",
+    _BAR_EQ,
+    "",
+)
+_RETRY_HINT = (
+    "",
+    "🔄 If you need to retry, use DIFFERENT selector or search text",
+    "",
+)
+_GUIDANCE_USE_FOUND = (
+    "💡 NEXT STEP GUIDANCE:",
+    "  → You have selectors from previous search",
+    "  → Pick first VISIBLE + INTERACTIVE selector",
+    "  → Use click/fill/press action immediately",
+    "",
+)
+_GUIDANCE_AFTER_SEARCH = (
+    "💡 NEXT STEP GUIDANCE:",
+    "  → Previous step was element search",
+    "  → Wait for search results in this step",
+    "  → If no results shown above, search may have failed",
+    "",
+)
+_GUIDANCE_SEARCH_FIRST = (
+    "💡 NEXT STEP GUIDANCE:",
+    "  → Before clicking/filling, search for element first",
+    "  → Use extract_correct_selector_using_text",
+    "  → Then use the found selector in next step",
+    "",
+)
+
+def render_element_context(ctx: dict) -> List[str]:
+    """Prompt block listing the selectors found by the last element search"""
+    lines = list(_ELEMENT_CONTEXT_HEADER)
+    lines.append(f"🔍 Search Text: '{ctx['text']}'")
+    lines.append(f"📊 Total Matches: {ctx.get('total_matches', 0)}")
+    
+    if ctx.get('all_elements'):
+        visible = [e for e in ctx['all_elements'] if e.get('is_visible')]
+        interactive = [e for e in ctx['all_elements'] if e.get('is_interactive')]
+        
+        lines.append(f"✅ Found: {len(visible)} visible, {len(interactive)} interactive elements")
+        lines.append("")
+        lines.append("📋 READY-TO-USE SELECTORS (Pick first visible + interactive):")
+        lines.append("")
+        
+        # Show top 3 matches with clear priority
+        for i, elem in enumerate(ctx['all_elements'][:3], 1):
+            vis_status = "✅ VISIBLE" if elem.get('is_visible') else "❌ HIDDEN"
+            inter_status = "🖱️ INTERACTIVE" if elem.get('is_interactive') else "📄 STATIC"
+            priority = "⭐ PRIORITY" if (elem.get('is_visible') and elem.get('is_interactive')) else ""
+            
+            lines.append(f"  [{i}] {elem['tag_name']} {priority}")
+            lines.append(f"      Status: {vis_status} | {inter_status}")
+            
+            if elem['suggested_selectors']:
+                best_selector = elem['suggested_selectors'][0]
+                lines.append(f"      🎯 USE THIS: {best_selector}")
+                if len(elem['suggested_selectors']) > 1:
+                    lines.append(f"      Alternatives: {', '.join(elem['suggested_selectors'][1:3])}")
+            
+            # Add interaction hint
+            if elem.get('is_visible') and elem.get('is_interactive'):
+                lines.append(f"      💡 NEXT ACTION: click/fill/press with selector above")
+            
+            lines.append("")
+    
+    lines.extend(_ELEMENT_CONTEXT_FOOTER)
+    return lines
+
+
 async def agent_reasoning_node(state: AgentState) -> AgentState:
     """🧠 OPTIMIZED AGENT REASONING NODE - Smart history with element prioritization"""
-    job_id = state['job_id']
-    push_status(job_id, "agent_step", {"step": state['step'], "max_steps": state['max_steps']})
+    job_id = state.job_id
+    push_status(job_id, "agent_step", {"step": state.step, "max_steps": state.max_steps})
     
-    screenshot_path = state['job_artifacts_dir'] / f"{state['step']:02d}_step.png"
+    screenshot_path = state.job_artifacts_dir / f"{state.step:02d}_step.jpg"
     screenshot_success = False
+    screenshot_b64 = None
     
     # 📸 Optimized screenshot (skip first 2 steps for speed)
-    if state['step'] > 2:
+    if state.step > 2:
         try:
-            await state['page'].wait_for_timeout(500)
-            await state['page'].screenshot(
-                path=screenshot_path, 
-                timeout=5000,
-                full_page=False,
-                type='png',
-            )
+            await state.page.wait_for_timeout(500)
+            screenshot_b64 = await capture_screenshot_jpeg(state.page, screenshot_path)
             screenshot_success = True
-            state['screenshots'].append(f"screenshots/{job_id}/{state['step']:02d}_step.png")
-            logger.info(f"Screenshot saved: {screenshot_path}")
+            state.screenshots.append(f"screenshots/{job_id}/{state.step:02d}_step.jpg")
+            logger.debug(f"Screenshot saved: {screenshot_path}")
         except Exception as e:
-            push_status(job_id, "screenshot_failed", {"error": str(e), "step": state['step']})
-            logger.warning(f"Screenshot failed at step {state['step']}: {e}")
+            push_status(job_id, "screenshot_failed", {"error": str(e), "step": state.step})
+            logger.warning(f"Screenshot failed at step {state.step}: {e}")
             screenshot_path = None
 
     # 🧠 Build SMART history with element context prioritized
@@ -1229,130 +1962,90 @@ async def agent_reasoning_node(state: AgentState) -> AgentState:
     # ═══════════════════════════════════════════════════════
     # PRIORITY 1: FOUND ELEMENT CONTEXT (Most Important!)
     # ═══════════════════════════════════════════════════════
-    if state.get('found_element_context'):
-        ctx = state['found_element_context']
-        history_lines.append("=" * 70)
-        history_lines.append("🎯 ELEMENT SEARCH RESULTS FROM PREVIOUS STEP - USE THESE NOW!")
-        history_lines.append("=" * 70)
-        history_lines.append(f"🔍 Search Text: '{ctx['text']}'")
-        history_lines.append(f"📊 Total Matches: {ctx.get('total_matches', 0)}")
-        
-        if ctx.get('all_elements'):
-            visible = [e for e in ctx['all_elements'] if e.get('is_visible')]
-            interactive = [e for e in ctx['all_elements'] if e.get('is_interactive')]
-            
-            history_lines.append(f"✅ Found: {len(visible)} visible, {len(interactive)} interactive elements")
-            history_lines.append("")
-            history_lines.append("📋 READY-TO-USE SELECTORS (Pick first visible + interactive):")
-            history_lines.append("")
-            
-            # Show top 3 matches with clear priority
-            for i, elem in enumerate(ctx['all_elements'][:3], 1):
-                vis_status = "✅ VISIBLE" if elem.get('is_visible') else "❌ HIDDEN"
-                inter_status = "🖱️ INTERACTIVE" if elem.get('is_interactive') else "📄 STATIC"
-                priority = "⭐ PRIORITY" if (elem.get('is_visible') and elem.get('is_interactive')) else ""
-                
-                history_lines.append(f"  [{i}] {elem['tag_name']} {priority}")
-                history_lines.append(f"      Status: {vis_status} | {inter_status}")
-                
-                if elem['suggested_selectors']:
-                    best_selector = elem['suggested_selectors'][0]
-                    history_lines.append(f"      🎯 USE THIS: {best_selector}")
-                    if len(elem['suggested_selectors']) > 1:
-                        history_lines.append(f"      Alternatives: {', '.join(elem['suggested_selectors'][1:3])}")
-                
-                # Add interaction hint
-                if elem.get('is_visible') and elem.get('is_interactive'):
-                    history_lines.append(f"      💡 NEXT ACTION: click/fill/press with selector above")
-                
-                history_lines.append("")
-        
-        history_lines.append("=" * 70)
-        history_lines.append("🚨 CRITICAL: Use above selectors immediately. DO NOT search again!")
-        history_lines.append("=" * 70)
-        history_lines.append("")
+    if state.found_element_context:
+        # The context usually survives several steps (wait, scroll, ...):
+        # reuse the rendered block until execute writes a new context
+        if state.element_context_lines_version != state.found_element_context_version:
+            state.element_context_lines = render_element_context(state.found_element_context)
+            state.element_context_lines_version = state.found_element_context_version
+        history_lines.extend(state.element_context_lines)
     
     # ═══════════════════════════════════════════════════════
     # PRIORITY 2: USER INPUT CONTEXT
     # ═══════════════════════════════════════════════════════
-    if state.get('user_input_response'):
-        input_type = state.get('user_input_request', {}).get('input_type', 'input')
-        is_sensitive = state.get('user_input_request', {}).get('is_sensitive', False)
-        actual_value = state['user_input_response']
+    if state.user_input_response:
+        input_request = state.user_input_request or {}
+        input_type = input_request.get('input_type', 'input')
+        is_sensitive = input_request.get('is_sensitive', False)
+        actual_value = state.user_input_response
         
-        history_lines.append("─" * 70)
         if is_sensitive:
-            history_lines.append(f"🔐 USER PROVIDED {input_type.upper()}: {actual_value}")
-            history_lines.append(f"⚠️ CRITICAL: Use EXACTLY '{actual_value}' in your fill action")
-            history_lines.append(f"🚫 DO NOT generate fake {input_type}s like 'Password@123' or 'test123'")
-            history_lines.append(f"✅ CORRECT: {{'type': 'fill', 'selector': '#password', 'text': '{actual_value}'}}")
+            history_lines.extend((
+                _BAR_DASH,
+                f"🔐 USER PROVIDED {input_type.upper()}: {actual_value}",
+                f"⚠️ CRITICAL: Use EXACTLY '{actual_value}' in your fill action",
+                f"🚫 DO NOT generate fake {input_type}s like 'Password@123' or 'test123'",
+                f"✅ CORRECT: {{'type': 'fill', 'selector': '#password', 'text': '{actual_value}'}}",
+                _BAR_DASH,
+                ""
+            ))
         else:
-            history_lines.append(f"👤 USER PROVIDED {input_type.upper()}: {actual_value}")
-            history_lines.append(f"💡 Use this exact value in your next fill action")
-        history_lines.append("─" * 70)
-        history_lines.append("")
+            history_lines.extend((
+                _BAR_DASH,
+                f"👤 USER PROVIDED {input_type.upper()}: {actual_value}",
+                "💡 Use this exact value in your next fill action",
+                _BAR_DASH,
+                ""
+            ))
     
     # ═══════════════════════════════════════════════════════
     # PRIORITY 3: RECENT ACTION HISTORY (Last 8 steps only)
     # ═══════════════════════════════════════════════════════
-    if state.get('history'):
+    if state.history:
         history_lines.append("📜 RECENT ACTIONS (Last 8 steps):")
-        recent = state['history'][-8:]
-        for line in recent:
-            history_lines.append(f"  {line}")
+        history_lines.extend(f"  {line}" for line in state.history[-8:])
         history_lines.append("")
     
     # ═══════════════════════════════════════════════════════
     # PRIORITY 4: FAILED ACTIONS WARNING
     # ═══════════════════════════════════════════════════════
-    if state.get('failed_actions'):
+    if state.failed_actions:
         history_lines.append("⚠️ FAILED ACTIONS - DO NOT REPEAT THESE:")
-        failed_list = sorted(state['failed_actions'].items(), key=lambda x: -x[1])
-        for sig, count in failed_list[:5]:
-            history_lines.append(f"  ❌ {sig} (failed {count} times)")
-        history_lines.append("")
-        history_lines.append("🔄 If you need to retry, use DIFFERENT selector or search text")
-        history_lines.append("")
+        history_lines.extend(
+            f"  ❌ {sig} (failed {count} times)" for sig, count in state.failed_actions.most_common(5)
+        )
+        history_lines.extend(_RETRY_HINT)
     
     # ═══════════════════════════════════════════════════════
     # PRIORITY 5: GUIDANCE BASED ON CONTEXT
     # ═══════════════════════════════════════════════════════
-    if state.get('found_element_context'):
-        history_lines.append("💡 NEXT STEP GUIDANCE:")
-        history_lines.append("  → You have selectors from previous search")
-        history_lines.append("  → Pick first VISIBLE + INTERACTIVE selector")
-        history_lines.append("  → Use click/fill/press action immediately")
-        history_lines.append("")
-    elif state['step'] > 1:
-        last_action_type = state.get('last_action', {}).get('type', '')
+    if state.found_element_context:
+        history_lines.extend(_GUIDANCE_USE_FOUND)
+    elif state.step > 1:
+        last_action_type = state.last_action.get('type', '')
         if last_action_type == 'extract_correct_selector_using_text':
-            history_lines.append("💡 NEXT STEP GUIDANCE:")
-            history_lines.append("  → Previous step was element search")
-            history_lines.append("  → Wait for search results in this step")
-            history_lines.append("  → If no results shown above, search may have failed")
-            history_lines.append("")
+            history_lines.extend(_GUIDANCE_AFTER_SEARCH)
         else:
-            history_lines.append("💡 NEXT STEP GUIDANCE:")
-            history_lines.append("  → Before clicking/filling, search for element first")
-            history_lines.append("  → Use extract_correct_selector_using_text")
-            history_lines.append("  → Then use the found selector in next step")
-            history_lines.append("")
+            history_lines.extend(_GUIDANCE_SEARCH_FIRST)
     
     history_text = "\n".join(history_lines)
 
     # 🤖 Get agent action with optimized prompt
     try:
-        action_response, usage = get_agent_action(
-            query=state['refined_query'],
-            url=state['page'].url,
-            html=await state['page'].content(),
-            provider=state['provider'],
+        # The provider SDKs are synchronous: run the call in a worker thread so
+        # other jobs' page round-trips and SSE streams keep going meanwhile
+        action_response, usage = await asyncio.to_thread(
+            get_agent_action,
+            query=state.refined_query,
+            url=state.page.url,
+            provider=state.provider,
             screenshot_path=screenshot_path if screenshot_success else None,
-            history=history_text
+            history=history_text,
+            screenshot_b64=screenshot_b64
         )
         
-        state['token_usage'].append({
-            "task": f"agent_step_{state['step']}",
+        state.token_usage.append({
+            "task": f"agent_step_{state.step}",
             **usage
         })
 
@@ -1363,7 +2056,7 @@ async def agent_reasoning_node(state: AgentState) -> AgentState:
         })
         
         # Log thought for debugging
-        logger.info(f"💭 Step {state['step']} Thought: {thought[:150]}...")
+        logger.info(f"💭 Step {state.step} Thought: {thought[:150]}...")
         
         if not action_response or not isinstance(action_response, dict):
             raise ValueError("Invalid action response format")
@@ -1376,10 +2069,10 @@ async def agent_reasoning_node(state: AgentState) -> AgentState:
         action_type = action.get("type")
         
         # If we have found elements, agent should NOT search again
-        if state.get('found_element_context') and action_type == 'extract_correct_selector_using_text':
+        if state.found_element_context and action_type == 'extract_correct_selector_using_text':
             logger.warning(f"⚠️ Agent tried to search again despite having found elements!")
             # Force agent to use found elements
-            ctx = state['found_element_context']
+            ctx = state.found_element_context
             if ctx.get('all_elements'):
                 first_elem = ctx['all_elements'][0]
                 if first_elem.get('suggested_selectors'):
@@ -1389,29 +2082,28 @@ async def agent_reasoning_node(state: AgentState) -> AgentState:
                     thought = f"Auto-corrected: Using previously found selector {best_selector}"
         
         # If agent is trying to click/fill without searching first (and no found elements)
-        if action_type in ['click', 'fill', 'press'] and not state.get('found_element_context'):
+        if action_type in ['click', 'fill', 'press'] and not state.found_element_context:
             selector = action.get('selector', '')
             # Check if selector is too generic (likely to fail)
-            generic_selectors = ['button', 'input', 'a', '.btn', 'div', 'span']
-            if selector.lower() in generic_selectors:
+            if selector.lower() in GENERIC_SELECTORS:
                 logger.warning(f"⚠️ Agent using generic selector '{selector}' without searching!")
                 # This will likely fail, but let it try so failure tracking works
         
-        state['last_action'] = action
-        logger.info(f"✅ Step {state['step']} Action: {action_type}")
+        state.last_action = action
+        logger.info(f"✅ Step {state.step} Action: {action_type}")
         
     except Exception as e:
         error_msg = f"Failed to get agent action: {str(e)}"
-        push_status(job_id, "agent_error", {"error": error_msg, "step": state['step']})
-        logger.error(f"Agent reasoning error at step {state['step']}: {error_msg}")
+        push_status(job_id, "agent_error", {"error": error_msg, "step": state.step})
+        logger.error(f"Agent reasoning error at step {state.step}: {error_msg}")
         
-        state['last_action'] = {
+        state.last_action = {
             "type": "finish", 
             "reason": f"Agent reasoning failed: {error_msg}"
         }
         
-        state['token_usage'].append({
-            "task": f"agent_step_{state['step']}_failed",
+        state.token_usage.append({
+            "task": f"agent_step_{state.step}_failed",
             "input_tokens": 0,
             "output_tokens": 0,
             "error": error_msg
@@ -1419,16 +2111,16 @@ async def agent_reasoning_node(state: AgentState) -> AgentState:
     
     # 🧹 Clear found element context after processing
     # (Only clear if agent actually used it or tried to use it)
-    if state.get('found_element_context'):
-        action_type = state['last_action'].get('type', '')
+    if state.found_element_context:
+        action_type = state.last_action.get('type', '')
         # Clear if agent took any interaction action (used the found elements)
         if action_type in ['click', 'fill', 'press', 'scroll', 'extract']:
             logger.info("🧹 Clearing found element context (used in this step)")
-            state['found_element_context'] = {}
+            state.found_element_context = {}
         # Also clear if agent tried to search again (ignored found elements)
         elif action_type == 'extract_correct_selector_using_text':
             logger.warning("🧹 Clearing found element context (agent searched again - will track as failure)")
-            state['found_element_context'] = {}
+            state.found_element_context = {}
     
     return state
 
@@ -1908,17 +2600,17 @@ async def agent_reasoning_node(state: AgentState) -> AgentState:
 
 async def execute_action_node(state: AgentState) -> AgentState:
     """⚡ ACTION EXECUTION with CAPTCHA as explicit action"""
-    job_id = state['job_id']
-    action = state['last_action']
-    page = state['page']
+    job_id = state.job_id
+    action = state.last_action
+    page = state.page
     
     action_signature = make_action_signature(action)
-    state['attempted_action_signatures'].append(action_signature)
+    state.attempted_action_signatures.append(action_signature)
 
     # Skip duplicate failures
-    if action_signature in state.get('failed_actions', {}):
-        state['history'].append(f"Step {state['step']}: ⏭ Skipped duplicate failed action")
-        state['step'] += 1
+    if action_signature in state.failed_actions:
+        state.history.append(f"Step {state.step}: ⏭ Skipped duplicate failed action")
+        state.step += 1
         return state
 
     push_status(job_id, "executing_action", {"action": action})
@@ -1926,11 +2618,14 @@ async def execute_action_node(state: AgentState) -> AgentState:
     
     try:
         action_type = action.get("type")
+        if action_type != "extract_correct_selector_using_text":
+            # Anything but a search may change the DOM under cached finder results
+            _FINDER_CACHE.clear()
         
         # ==== 🆕 SOLVE_CAPTCHA ACTION (NEW!) ====
         if action_type == "solve_captcha":
             logger.info(f"🤖 LLM requested CAPTCHA solving explicitly")
-            state['history'].append(f"Step {state['step']}: 🤖 Starting CAPTCHA solve...")
+            state.history.append(f"Step {state.step}: 🤖 Starting CAPTCHA solve...")
             
             try:
                 # Import your CaptchaSolver
@@ -1942,13 +2637,13 @@ async def execute_action_node(state: AgentState) -> AgentState:
                 
                 if result.get('solved', False):
                     action_success = True
-                    state['history'].append(
-                        f"Step {state['step']}: ✅ CAPTCHA solved: {result.get('type')} via {result.get('method')}"
+                    state.history.append(
+                        f"Step {state.step}: ✅ CAPTCHA solved: {result.get('type')} via {result.get('method')}"
                     )
                     push_status(job_id, "captcha_solved", {
                         "type": result.get('type'),
                         "method": result.get('method'),
-                        "step": state['step']
+                        "step": state.step
                     })
                     
                     # Wait for page to process solution
@@ -1956,18 +2651,18 @@ async def execute_action_node(state: AgentState) -> AgentState:
                     
                 else:
                     error = result.get('error', 'Unknown error')
-                    state['history'].append(f"Step {state['step']}: ❌ CAPTCHA failed: {error}")
+                    state.history.append(f"Step {state.step}: ❌ CAPTCHA failed: {error}")
                     push_status(job_id, "captcha_failed", {
                         "error": error,
-                        "step": state['step']
+                        "step": state.step
                     })
                     
                     # Mark as failed action
-                    state['failed_actions'][action_signature] = state['failed_actions'].get(action_signature, 0) + 1
+                    state.failed_actions[action_signature] += 1
                     
             except Exception as e:
                 error_msg = str(e)[:100]
-                state['history'].append(f"Step {state['step']}: ❌ CAPTCHA error: {error_msg}")
+                state.history.append(f"Step {state.step}: ❌ CAPTCHA error: {error_msg}")
                 push_status(job_id, "captcha_error", {"error": error_msg})
         
         # ==== CLICK ACTION ====
@@ -1983,31 +2678,31 @@ async def execute_action_node(state: AgentState) -> AgentState:
             used_user_input = False
             
             # Handle user input placeholders
-            if fill_text in ["{{USER_INPUT}}", "{{PASSWORD}}", "{{EMAIL}}", "{{PHONE}}", "{{OTP}}"]:
-                if state.get('user_input_response'):
-                    fill_text = state['user_input_response']
+            if fill_text in USER_INPUT_PLACEHOLDERS:
+                if state.user_input_response:
+                    fill_text = state.user_input_response
                     used_user_input = True
                 else:
                     raise ValueError(f"Placeholder {fill_text} requires user input")
             
-            elif state.get('user_input_response') and fill_text == state['user_input_response']:
+            elif state.user_input_response and fill_text == state.user_input_response:
                 used_user_input = True
             
             # Force user password for password fields
-            elif (state.get('user_input_response') and 
-                  ('password' in selector.lower() or 'pass' in selector.lower()) and
-                  state.get('user_input_request', {}).get('input_type') == 'password'):
-                fill_text = state['user_input_response']
+            elif (state.user_input_response and 
+                  _PASSWORD_SELECTOR_RE.search(selector) and
+                  (state.user_input_request or {}).get('input_type') == 'password'):
+                fill_text = state.user_input_response
                 used_user_input = True
-                state['history'].append(f"Step {state['step']}: 🔑 Using user password")
+                state.history.append(f"Step {state.step}: 🔑 Using user password")
             
             await page.locator(selector).fill(fill_text, timeout=8000)
             action_success = True
             
             if used_user_input:
-                state['user_input_response'] = ""
-                state['user_input_request'] = {}
-                state['user_input_flow_active'] = False
+                state.user_input_response = ""
+                state.user_input_request = {}
+                state.user_input_flow_active = False
                 JOBS_IN_INPUT_FLOW.discard(job_id)
         
         # ==== PRESS ACTION ====
@@ -2026,21 +2721,26 @@ async def execute_action_node(state: AgentState) -> AgentState:
         # ==== EXTRACT ACTION ====
         elif action_type == "extract":
             items = action.get("items", [])
+            base_url = page.url
+            base_parts = urlsplit(base_url)
+            origin = (f"{base_parts.scheme}://{base_parts.netloc}"
+                      if base_parts.scheme in ("http", "https") and base_parts.netloc else None)
             for item in items:
                 if 'url' in item and isinstance(item.get('url'), str):
-                    item['url'] = urljoin(page.url, item['url'])
-            state['results'].extend(items)
+                    item['url'] = _resolve_item_url(base_url, origin, item['url'])
+            state.results.extend(items)
             action_success = True
             push_status(job_id, "partial_result", {"new_items_found": len(items)})
         
         # ==== POPUP DISMISSAL ====
         elif action_type == "dismiss_popup_using_text":
             try:
+                # Same isolated world install_popup_killer injected into
                 kill_count = await page.evaluate("window.__popupKillCount ? window.__popupKillCount() : 0")
-                state['history'].append(f"Step {state['step']}: ℹ️ Popup killer: {kill_count} removed")
+                state.history.append(f"Step {state.step}: ℹ️ Popup killer: {kill_count} removed")
                 action_success = True
             except Exception as e:
-                state['history'].append(f"Step {state['step']}: ⚠️ Popup check: {str(e)[:50]}")
+                state.history.append(f"Step {state.step}: ⚠️ Popup check: {str(e)[:50]}")
         
         # ==== ELEMENT SEARCH ====
         elif action_type == "extract_correct_selector_using_text":
@@ -2063,16 +2763,17 @@ async def execute_action_node(state: AgentState) -> AgentState:
                         "is_interactive": match.get('is_interactive')
                     })
                 
-                state['found_element_context'] = {
+                state.found_element_context = {
                     "text": search_text,
                     "total_matches": len(limited_result),
                     "all_elements": all_elements_context
                 }
+                state.found_element_context_version += 1
                 
-                state['history'].append(f"Step {state['step']}: ⚡ Found {len(limited_result)} elements")
+                state.history.append(f"Step {state.step}: ⚡ Found {len(limited_result)} elements")
                 action_success = True
             else:
-                state['history'].append(f"Step {state['step']}: ❌ No elements found for '{search_text}'")
+                state.history.append(f"Step {state.step}: ❌ No elements found for '{search_text}'")
         
         # ==== USER INPUT REQUEST ====
         elif action_type == "request_user_input":
@@ -2085,78 +2786,77 @@ async def execute_action_node(state: AgentState) -> AgentState:
                 "prompt": prompt,
                 "is_sensitive": is_sensitive,
                 "timestamp": get_current_timestamp(),
-                "step": state['step']
+                "step": state.step
             }
             
-            USER_INPUT_REQUESTS[job_id] = user_input_request
-            state['user_input_request'] = user_input_request
-            state['waiting_for_user_input'] = True
-            state['user_input_flow_active'] = True
+            pending = asyncio.get_running_loop().create_future()
+            deadline = time.time() + STUCK_INPUT_TIMEOUT
+            INPUT_WAITS[job_id] = InputWait(user_input_request, pending, deadline)
+            notify_status_change(job_id)
+            heapq.heappush(_INPUT_DEADLINES, (deadline, job_id))
+            state.user_input_request = user_input_request
+            state.waiting_for_user_input = True
+            state.user_input_flow_active = True
             JOBS_IN_INPUT_FLOW.add(job_id)
             
-            input_event = asyncio.Event()
-            PENDING_JOBS[job_id] = input_event
-            
             push_status(job_id, "user_input_required", {
                 "input_type": input_type,
                 "prompt": prompt,
                 "is_sensitive": is_sensitive
             })
             
-            state['history'].append(f"Step {state['step']}: 🔄 Waiting for user input")
+            state.history.append(f"Step {state.step}: 🔄 Waiting for user input")
             
             try:
-                await asyncio.wait_for(input_event.wait(), timeout=300)
-                user_response = USER_INPUT_RESPONSES.get(job_id, "")
-                state['user_input_response'] = user_response
-                state['waiting_for_user_input'] = False
+                user_response = await asyncio.wait_for(pending, timeout=300)
+                state.user_input_response = user_response
+                state.waiting_for_user_input = False
                 
-                USER_INPUT_REQUESTS.pop(job_id, None)
-                USER_INPUT_RESPONSES.pop(job_id, None)
-                PENDING_JOBS.pop(job_id, None)
+                INPUT_WAITS.pop(job_id, None)
+                notify_status_change(job_id)
                 
-                state['history'].append(f"Step {state['step']}: ✅ User input received")
+                state.history.append(f"Step {state.step}: ✅ User input received")
                 action_success = True
                 
             except asyncio.TimeoutError:
-                state['waiting_for_user_input'] = False
-                state['user_input_flow_active'] = False
+                state.waiting_for_user_input = False
+                state.user_input_flow_active = False
                 JOBS_IN_INPUT_FLOW.discard(job_id)
-                USER_INPUT_REQUESTS.pop(job_id, None)
-                PENDING_JOBS.pop(job_id, None)
+                INPUT_WAITS.pop(job_id, None)
+                notify_status_change(job_id)
                 raise ValueError(f"User input timeout: {prompt}")
         
         # ==== FINISH ACTION ====
         elif action_type == "finish":
             action_success = True
-            state['history'].append(f"Step {state['step']}: 🏁 {action.get('reason', 'Complete')}")
+            state.history.append(f"Step {state.step}: 🏁 {action.get('reason', 'Complete')}")
         
         # SUCCESS PATH
         if action_success:
-            state['history'].append(f"Step {state['step']}: ✅ {action_type}")
+            state.history.append(f"Step {state.step}: ✅ {action_type}")
             await page.wait_for_timeout(200)
         
     except Exception as e:
         error_msg = str(e)[:100]
-        state['history'].append(f"Step {state['step']}: ❌ {action_type}: {error_msg}")
-        state['failed_actions'][action_signature] = state['failed_actions'].get(action_signature, 0) + 1
+        state.history.append(f"Step {state.step}: ❌ {action_type}: {error_msg}")
+        state.failed_actions[action_signature] += 1
         push_status(job_id, "action_failed", {"action": action, "error": error_msg})
     
-    state['step'] += 1
+    state.step += 1
     return state
 # ==================== SUPERVISOR ====================
 def supervisor_node(state: AgentState) -> str:
     """🎯 SUPERVISOR - Controls workflow continuation"""
-    if state['last_action'].get("type") == "finish":
-        push_status(state['job_id'], "agent_finished", {"reason": state['last_action'].get("reason")})
+    if state.last_action.get("type") == "finish":
+        push_status(state.job_id, "agent_finished", {"reason": state.last_action.get("reason")})
         return END
-    if len(state['results']) >= state['top_k']:
-        push_status(state['job_id'], "agent_finished", {"reason": f"Collected {len(state['results'])}/{state['top_k']} items."})
+    if len(state.results) >= state.top_k:
+        push_status(state.job_id, "agent_finished", {"reason": f"Collected {len(state.results)}/{state.top_k} items."})
         return END
-    if state['step'] > state['max_steps']:
-        push_status(state['job_id'], "agent_stopped", {"reason": "Max steps reached."})
+    if state.step > state.max_steps:
+        push_status(state.job_id, "agent_stopped", {"reason": "Max steps reached."})
         return END
-    if state.get('waiting_for_user_input', False):
+    if state.waiting_for_user_input:
         return "continue"
     return "continue"
 
@@ -2208,7 +2908,7 @@ async def run_job(job_id: str, payload: dict, device_id: str = "ZD222GXYPV"):
             device_id += '/'
         
         # Get WebSocket URL for ngrok
-        async with aiohttp.ClientSession() as session:
+        async with http_session() as session:
             try:
                 async with session.get(f"{device_id}json/version") as resp:
                     data = await resp.json()
@@ -2217,20 +2917,21 @@ async def run_job(job_id: str, payload: dict, device_id: str = "ZD222GXYPV"):
             except Exception as e:
                 logger.error(f"❌ Failed to get WebSocket URL from ngrok: {e}")
                 push_status(job_id, "job_failed", {"error": f"Ngrok connection failed: {str(e)}"})
-                JOB_RESULTS[job_id] = {"status": "failed", "error": str(e)}
+                store_job_result(job_id, {"status": "failed", "error": str(e)})
                 return
     else:
         logger.info(f"📱 Using local Android device: {device_id}")
         
         try:
-            port = setup_chrome_automation_android(device_id)
+            # adb calls and fixed sleeps: keep them off the event loop
+            port = await asyncio.to_thread(setup_chrome_automation_android, device_id)
             logger.info(f"✅ Chrome automation ready on port {port}")
             cdp_endpoint = f"http://localhost:{port}"
         except Exception as e:
             error_msg = f"Chrome setup failed: {str(e)}"
             logger.error(f"❌ {error_msg}")
             push_status(job_id, "job_failed", {"error": error_msg})
-            JOB_RESULTS[job_id] = {"status": "failed", "error": error_msg}
+            store_job_result(job_id, {"status": "failed", "error": error_msg})
             return
     
     provider = payload["llm_provider"]
@@ -2245,114 +2946,146 @@ async def run_job(job_id: str, payload: dict, device_id: str = "ZD222GXYPV"):
     }
     
     # 🔥 ANDROID-ONLY: Connect to device, then apply stealth
-    async with async_playwright() as p:
-        browser = None
-        context = None
-        page = None
+    browser = None
+    context = None
+    page = None
+    
+    try:
+        logger.info(f"📱 Connecting to Android device via CDP: {cdp_endpoint}")
         
+        # ✅ ALWAYS connect to Android device first
+        # One Playwright driver serves every job; only the CDP connection is per job
+        p = await get_playwright()
         try:
-            logger.info(f"📱 Connecting to Android device via CDP: {cdp_endpoint}")
-            
-            # ✅ ALWAYS connect to Android device first
             browser = await p.chromium.connect_over_cdp(cdp_endpoint)
-            contexts = browser.contexts
-            
-            if not contexts:
-                logger.info("📱 Creating new context on Android device...")
-                context = await browser.new_context(
-                    user_agent="Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36",
-                    viewport={"width": 393, "height": 851},
-                    device_scale_factor=2.75,
-                    is_mobile=True,
-                    has_touch=True,
-                    locale="en-IN",
-                    timezone_id="Asia/Kolkata",
-                    storage_state=None,
-                )
-            else:
-                logger.info("📱 Using existing context on Android device...")
-                context = contexts[0]
-            
-           
-            # Create page
-            page = await context.new_page()
-            logger.info("✅ Android automation ready!")
+        except Exception as e:
+            if not driver_gone(e):
+                raise
+            # The shared driver process died; start a fresh one and retry once
+            logger.warning("♻️ Playwright driver is gone, restarting it")
+            await discard_playwright(p)
+            p = await get_playwright()
+            browser = await p.chromium.connect_over_cdp(cdp_endpoint)
+        contexts = browser.contexts
+        
+        if not contexts:
+            logger.info("📱 Creating new context on Android device...")
+            context = await browser.new_context(
+                user_agent="Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36",
+                viewport={"width": 393, "height": 851},
+                device_scale_factor=2.75,
+                is_mobile=True,
+                has_touch=True,
+                locale="en-IN",
+                timezone_id="Asia/Kolkata",
+                storage_state=None,
+            )
+        else:
+            logger.info("📱 Using existing context on Android device...")
+            context = contexts[0]
+        
+       
+        # Create page
+        page = await context.new_page()
+        # 🛡️ Popup killer, re-injected on every later navigation
+        await install_popup_killer(page)
+        logger.info("✅ Android automation ready!")
+        
+        final_result = {}
+        final_state = {}
+        
+        try:
+            push_status(job_id, "job_started", {"provider": provider, "query": payload["query"]})
             
-            final_result = {}
-            final_state = {}
+            refined_query, usage = await asyncio.to_thread(
+                get_refined_prompt, payload["url"], payload["query"], provider
+            )
+            job_analysis["steps"].append({"task": "refine_prompt", **usage})
+            push_status(job_id, "prompt_refined", {"refined_query": refined_query, "usage": usage})
+
+            initial_state = AgentState(
+                job_id=job_id, 
+                browser=browser, 
+                page=page, 
+                query=payload["url"],
+                top_k=payload["top_k"], 
+                provider=provider,
+                refined_query=refined_query, 
+                results=[], 
+                screenshots=[],
+                job_artifacts_dir=SCREENSHOTS_DIR / job_id,
+                step=1, 
+                max_steps=100, 
+                last_action={},
+                history=[],
+                token_usage=[],
+                found_element_context={},
+                found_element_context_version=0,
+                element_context_lines=[],
+                element_context_lines_version=-1,
+                failed_actions=Counter(),
+                attempted_action_signatures=[],
+                waiting_for_user_input=False,
+                user_input_request={},
+                user_input_response="",
+                user_input_flow_active=False
+            )
+            initial_state.job_artifacts_dir.mkdir(exist_ok=True)
             
-            try:
-                push_status(job_id, "job_started", {"provider": provider, "query": payload["query"]})
-                
-                refined_query, usage = get_refined_prompt(payload["url"], payload["query"], provider)
-                job_analysis["steps"].append({"task": "refine_prompt", **usage})
-                push_status(job_id, "prompt_refined", {"refined_query": refined_query, "usage": usage})
-
-                initial_state = AgentState(
-                    job_id=job_id, 
-                    browser=browser, 
-                    page=page, 
-                    query=payload["url"],
-                    top_k=payload["top_k"], 
-                    provider=provider,
-                    refined_query=refined_query, 
-                    results=[], 
-                    screenshots=[],
-                    job_artifacts_dir=SCREENSHOTS_DIR / job_id,
-                    step=1, 
-                    max_steps=100, 
-                    last_action={},
-                    history=[],
-                    token_usage=[],
-                    found_element_context={},
-                    failed_actions={},
-                    attempted_action_signatures=[],
-                    waiting_for_user_input=False,
-                    user_input_request={},
-                    user_input_response="",
-                    user_input_flow_active=False
-                )
-                initial_state['job_artifacts_dir'].mkdir(exist_ok=True)
-                
-                final_state = await graph_app.ainvoke(initial_state, {"recursion_limit": 200})
+            final_state = await graph_app.ainvoke(initial_state, {"recursion_limit": 200})
 
-                final_result = {
-                    "job_id": job_id, 
-                    "results": final_state['results'], 
-                    "screenshots": final_state['screenshots']
-                }
-                
-            except Exception as e:
-                push_status(job_id, "job_failed", {"error": str(e), "trace": traceback.format_exc()})
-                final_result = {"job_id": job_id, "error": str(e)}
-                
-            finally:
-                JOB_RESULTS[job_id] = final_result
-                push_status(job_id, "job_done")
-                
-                if final_state:
-                    job_analysis["steps"].extend(final_state.get('token_usage', []))
-                save_analysis_report(job_analysis)
-                
-                if page:
-                    await page.close()
-                if context:
-                    await context.close()
-                if browser:
-                    await browser.close()
-                
+            final_result = {
+                "job_id": job_id, 
+                "results": final_state['results'], 
+                "screenshots": final_state['screenshots']
+            }
+            
         except Exception as e:
-            logger.error(f"❌ Browser connection error: {e}")
-            push_status(job_id, "job_failed", {"error": f"Browser connection failed: {str(e)}"})
-            JOB_RESULTS[job_id] = {"status": "failed", "error": str(e)}
+            failure = {"error": str(e)}
+            if DEBUG_TRACE:
+                failure["trace"] = traceback.format_exc()
+            push_status(job_id, "job_failed", failure)
+            final_result = {"job_id": job_id, "error": str(e)}
+            
+        finally:
+            # The job writes no more screenshots: index them before the
+            # result (and job_done) tells clients to go fetch them
+            await wait_for_screenshot_writes(SCREENSHOTS_DIR / job_id)
+            index_job_screenshots(job_id)
+            store_job_result(job_id, final_result)
+            push_status(job_id, "job_done")
+            
+            if final_state:
+                job_analysis["steps"].extend(final_state.get('token_usage', []))
+            await save_analysis_report(job_analysis)
+            
+            if page:
+                await page.close()
+            if context:
+                await context.close()
+            if browser:
+                await browser.close()
+            
+    except Exception as e:
+        logger.error(f"❌ Browser connection error: {e}")
+        push_status(job_id, "job_failed", {"error": f"Browser connection failed: {str(e)}"})
+        store_job_result(job_id, {"status": "failed", "error": str(e)})
 
 # ==================== FASTAPI ENDPOINTS ====================
 @app.post("/search")
 async def start_search(req: SearchRequest):
     """🔍 Start new search job"""
     job_id = str(uuid.uuid4())
-    JOB_QUEUES[job_id] = asyncio.Queue()
-    asyncio.create_task(run_job(job_id, {**req.model_dump(), "device_id": "ZD222GXYPV"}))
+    JOB_QUEUES[job_id] = _acquire_queue()
+    # run_job reads nothing from the request context, so start it in an empty
+    # Context instead of paying for copy_context() on every job
+    task = asyncio.create_task(
+        run_job(job_id, {**req.model_dump(), "device_id": "ZD222GXYPV"}),
+        context=contextvars.Context()
+    )
+    # The loop only keeps weak references to tasks: hold one until it finishes
+    BACKGROUND_TASKS.add(task)
+    task.add_done_callback(BACKGROUND_TASKS.discard)
     return {
         "job_id": job_id, 
         "stream_url": f"/stream/{job_id}", 
@@ -2366,15 +3099,35 @@ async def stream_status(job_id: str):
     if not q: 
         raise HTTPException(status_code=404, detail="Job not found")
     
+    # Must stay an async generator: StreamingResponse iterates sync generators
+    # in a threadpool, one executor hop per chunk
     async def event_generator():
-        while True:
-            try:
-                msg = await asyncio.wait_for(q.get(), timeout=60)
-                yield f"data: {json.dumps(msg)}\n\n"
-                if msg["msg"] in ("job_done", "job_failed"): 
+        _QUEUE_READERS[job_id] = _QUEUE_READERS.get(job_id, 0) + 1
+        try:
+            async for batch in q:
+                if batch is None:
+                    yield b": keep-alive\n\n"
+                    continue
+                # One chunk (one socket write) per batch, one SSE event per entry
+                events = []
+                finished = False
+                for msg in batch:
+                    events.append(b"data: " + orjson.dumps(msg, option=orjson.OPT_NON_STR_KEYS) + b"\n\n")
+                    if msg["msg"] in ("job_done", "job_failed"):
+                        finished = True
+                        break
+                yield b"".join(events)
+                if finished:
+                    JOB_QUEUES.pop(job_id, None)
+                    notify_status_change(job_id)
                     break
-            except asyncio.TimeoutError: 
-                yield ": keep-alive\n\n"
+        finally:
+            # Only recycle once the job has finished and no other reader holds q
+            readers = _QUEUE_READERS.pop(job_id, 1) - 1
+            if readers:
+                _QUEUE_READERS[job_id] = readers
+            elif job_id not in JOB_QUEUES:
+                _release_queue(q)
     
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
@@ -2384,59 +3137,111 @@ async def get_result(job_id: str):
     result = JOB_RESULTS.get(job_id)
     if not result: 
         return JSONResponse({"status": "pending"}, status_code=202)
-    return JSONResponse(result)
+    # Results can carry hundreds of extracted items: encode them in a worker
+    # thread rather than holding the event loop for the whole dump
+    body = await asyncio.to_thread(orjson.dumps, result, option=orjson.OPT_NON_STR_KEYS)
+    return Response(content=body, media_type="application/json")
 
 @app.get("/screenshots/{job_id}/{filename}")
-async def get_screenshot(job_id: str, filename: str):
+async def get_screenshot(job_id: str, filename: str, request: Request):
     """📸 Get screenshot file"""
-    file_path = SCREENSHOTS_DIR / job_id / filename
-    if not file_path.exists(): 
+    # Both parts are validated instead of resolving the path, so ".." and
+    # other traversal tricks never reach the filesystem
+    if not (_JOB_ID_RE.fullmatch(job_id) and _SCREENSHOT_NAME_RE.fullmatch(filename)):
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+    file_path = f"{SCREENSHOTS_DIR_STR}/{job_id}/{filename}"
+    # Finished jobs are served from their index; running ones are stat'ed once
+    # here. Either way FileResponse gets the stat and does not redo it
+    st = SCREENSHOT_INDEX.get(job_id, {}).get(filename)
+    if st is None:
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            pass
+    if st is None or not stat.S_ISREG(st.st_mode):
         raise HTTPException(status_code=404, detail="Screenshot not found")
-    return FileResponse(file_path)
+    # A step's screenshot is written once and never changes, so clients may
+    # cache it for good and revalidate with If-None-Match
+    headers = {
+        "ETag": f'"{st.st_mtime_ns:x}-{st.st_size:x}"',
+        "Cache-Control": SCREENSHOT_CACHE_CONTROL,
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(file_path, stat_result=st, headers=headers)
 
 @app.get("/user-input-request/{job_id}")
 async def get_user_input_request(job_id: str):
     """💬 Get pending user input request"""
-    if job_id not in USER_INPUT_REQUESTS:
+    wait = INPUT_WAITS.get(job_id)
+    if wait is None:
         raise HTTPException(status_code=404, detail="No pending user input request for this job")
     
-    return {"job_id": job_id, **USER_INPUT_REQUESTS[job_id]}
+    return {"job_id": job_id, **wait.request}
 
 @app.post("/user-input-response")
 async def submit_user_input(response: UserInputResponse):
     """✅ Submit user input to resume job"""
     job_id = response.job_id
     
-    if job_id not in USER_INPUT_REQUESTS:
+    wait = INPUT_WAITS.get(job_id)
+    if wait is None:
         raise HTTPException(status_code=404, detail="No pending user input request for this job")
     
-    if job_id not in PENDING_JOBS:
+    if wait.pending.done():
         raise HTTPException(status_code=400, detail="Job is not waiting for user input")
     
-    USER_INPUT_RESPONSES[job_id] = response.input_value
-    
-    event = PENDING_JOBS[job_id]
-    event.set()
+    release_pending_job(job_id, response.input_value)
     
     return {"status": "success", "message": "User input received, job will resume"}
 
 @app.get("/jobs/{job_id}/status")
-async def get_job_status(job_id: str):
-    """📋 Get comprehensive job status"""
+async def get_job_status(job_id: str, wait: float = 0):
+    """📋 Get comprehensive job status (with ?wait=N, after the next change or N seconds)"""
+    # Only a running job can still change; its final store_job_result
+    # notifies, so no event outlives the job
+    if wait > 0 and job_id in JOB_QUEUES and job_id not in JOB_RESULTS:
+        evt = _STATUS_EVENTS.get(job_id)
+        if evt is None:
+            evt = _STATUS_EVENTS[job_id] = asyncio.Event()
+        try:
+            await asyncio.wait_for(evt.wait(), timeout=min(wait, STATUS_MAX_WAIT))
+        except asyncio.TimeoutError:
+            pass
+    
+    # Results and input requests are replaced, never mutated in place, so the
+    # identities below change exactly when the response body would
+    result = JOB_RESULTS.get(job_id)
+    input_wait = INPUT_WAITS.get(job_id)
+    input_request = input_wait.request if input_wait else None
+    is_running = job_id in JOB_QUEUES
+    cached = _STATUS_CACHE.get(job_id)
+    if cached:
+        (c_result, c_request, c_running), body = cached
+        if c_result is result and c_request is input_request and c_running == is_running:
+            _STATUS_CACHE.move_to_end(job_id)
+            return Response(content=body, media_type="application/json")
+    
     status = {
         "job_id": job_id,
-        "has_result": job_id in JOB_RESULTS,
-        "waiting_for_input": job_id in USER_INPUT_REQUESTS,
-        "is_running": job_id in JOB_QUEUES
+        "has_result": result is not None,
+        "waiting_for_input": input_request is not None,
+        "is_running": is_running
     }
     
-    if job_id in USER_INPUT_REQUESTS:
-        status["input_request"] = USER_INPUT_REQUESTS[job_id]
+    if input_request is not None:
+        status["input_request"] = input_request
     
-    if job_id in JOB_RESULTS:
-        status["result"] = JOB_RESULTS[job_id]
+    if result is not None:
+        status["result"] = result
     
-    return status
+    body = orjson.dumps(status, option=orjson.OPT_NON_STR_KEYS)
+    _STATUS_CACHE[job_id] = ((result, input_request, is_running), body)
+    _STATUS_CACHE.move_to_end(job_id)
+    if len(_STATUS_CACHE) > STATUS_CACHE_SIZE:
+        _STATUS_CACHE.popitem(last=False)
+    return Response(content=body, media_type="application/json")
 
 @app.post("/admin/cleanup-stuck-jobs")
 async def cleanup_stuck_jobs_endpoint():
@@ -2454,11 +3259,11 @@ async def get_system_status():
     return {
         "active_jobs": len(JOB_QUEUES),
         "completed_jobs": len(JOB_RESULTS),
-        "pending_input_requests": len(USER_INPUT_REQUESTS),
-        "pending_responses": len(USER_INPUT_RESPONSES),
+        "pending_input_requests": len(INPUT_WAITS),
+        "pending_responses": sum(1 for wait in INPUT_WAITS.values() if wait.pending.done()),
         "jobs_in_input_flow": len(JOBS_IN_INPUT_FLOW),
         "input_flow_jobs": list(JOBS_IN_INPUT_FLOW),
-        "stuck_jobs_cleaned": cleanup_stuck_jobs()
+        "stuck_jobs_cleaned": _STUCK_JOBS_CLEANED
     }
 
 @app.get("/")
@@ -2474,4 +3279,6 @@ if __name__ == "__main__":
     logger.info("📦 Features: Malenia + Stealth, CAPTCHA Solver, Popup Killer, HITL")
     logger.info("🌐 Server: http://0.0.0.0:8000")
     
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # loop="auto" picks uvloop where it is installed (not on Windows). Jobs,
+    # streams and input waiters live in this process, so stay on one worker
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="auto", http="httptools", timeout_graceful_shutdown=30)
\ No newline at end of file